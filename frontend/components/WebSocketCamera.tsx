@@ -15,6 +15,8 @@ export interface AttendanceResult {
         status: string
     }
     error?: string
+    // Sequence number of the frame this result belongs to
+    seq?: number
 }
 
 export interface WebSocketCameraRef {
@@ -26,16 +28,21 @@ interface WebSocketCameraProps {
     serverUrl?: string
     intervalMs?: number
     autoCapture?: boolean
+    // Send frames as raw JPEG bytes instead of base64 data URLs
+    binary?: boolean
 }
 
 // Ensure we only have one socket instance
 let socket: Socket | null = null;
+// Increasing frame number, echoed back by the server in attendance_result
+let frameSeq = 0;
 
 export const WebSocketCamera = forwardRef<WebSocketCameraRef, WebSocketCameraProps>(({
     onResult,
     serverUrl = process.env.NEXT_PUBLIC_API_URL || "http://localhost:5001",
     intervalMs = 500,
-    autoCapture = true
+    autoCapture = true,
+    binary = true
 }, ref) => {
     const videoRef = useRef<HTMLVideoElement>(null)
     const canvasRef = useRef<HTMLCanvasElement>(null)
@@ -128,6 +135,8 @@ export const WebSocketCamera = forwardRef<WebSocketCameraRef, WebSocketCameraPro
     // Processing loop (Auto Capture)
     useEffect(() => {
         let intervalId: NodeJS.Timeout
+        // toBlob finishes out of order; sends are chained so frames leave in seq order
+        let sendChain: Promise<void> = Promise.resolve()
 
         if (stream && isConnected && socket && autoCapture) {
             intervalId = setInterval(() => {
@@ -141,8 +150,19 @@ export const WebSocketCamera = forwardRef<WebSocketCameraRef, WebSocketCameraPro
                         const ctx = canvas.getContext('2d')
                         if (ctx) {
                             ctx.drawImage(video, 0, 0)
-                            const base64 = canvas.toDataURL("image/jpeg", 0.7)
-                            socket?.emit("process_frame", { image: base64 })
+                            if (binary) {
+                                const seq = ++frameSeq
+                                const encoded = new Promise<Blob | null>((resolve) => canvas.toBlob(resolve, "image/jpeg", 0.7))
+                                sendChain = sendChain.then(async () => {
+                                    const blob = await encoded
+                                    if (!blob) return
+                                    const buffer = await blob.arrayBuffer()
+                                    socket?.emit("process_frame", { image: buffer, seq })
+                                }).catch((e) => console.error("Frame send error:", e))
+                            } else {
+                                const base64 = canvas.toDataURL("image/jpeg", 0.7)
+                                socket?.emit("process_frame", { image: base64, seq: ++frameSeq })
+                            }
                         }
                     }
                 }
@@ -150,7 +170,7 @@ export const WebSocketCamera = forwardRef<WebSocketCameraRef, WebSocketCameraPro
         }
 
         return () => clearInterval(intervalId)
-    }, [stream, isConnected, intervalMs, autoCapture])
+    }, [stream, isConnected, intervalMs, autoCapture, binary])
 
     // Expose capture method
     useImperativeHandle(ref, () => ({
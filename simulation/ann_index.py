@@ -0,0 +1,293 @@
+import threading
+import time
+import numpy as np
+
+
+class IVFIndex:
+    """
+    Inverted-file (IVF) approximate nearest-neighbour index for face encodings.
+
+    Encodings are partitioned by k-means into `nlist` cells. A query only scans
+    the `nprobe` cells closest to it and returns the `rerank` nearest distinct
+    users as candidates. The caller (FaceGallery) then re-ranks those candidates
+    exactly, so the final tolerance decision is the same as brute force as long
+    as the true match is among the candidates.
+
+    Knobs:
+      nprobe  - cells scanned per query (higher = better recall, slower)
+      rerank  - distinct candidate users passed to the exact re-rank
+
+    Inserts and deletes are applied to the current cells immediately. When the
+    cells drift (too much churn since the last build, or one cell grows far
+    beyond the average) a rebuild runs in a background thread and is swapped
+    in when done; writes made during the rebuild are replayed on top of it.
+    Centroids and cells are published together as one (centroids, cells)
+    tuple, so a query never pairs one build's centroids with another's
+    cells. A failed rebuild is retried only after a backoff that doubles up
+    to `rebuild_backoff_max` seconds.
+    """
+
+    def __init__(self, dim, nlist=0, nprobe=8, rerank=32, min_rows=2048,
+                 rebuild_churn=0.2, rebuild_imbalance=8.0, kmeans_iters=10,
+                 rebuild_backoff=30.0, rebuild_backoff_max=600.0):
+        self.dim = dim
+        self.nlist = nlist            # 0 = pick from gallery size at build time
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self.min_rows = min_rows      # below this, brute force is faster anyway
+        self.rebuild_churn = rebuild_churn
+        self.rebuild_imbalance = rebuild_imbalance
+        self.kmeans_iters = kmeans_iters
+        self.rebuild_backoff = rebuild_backoff
+        self.rebuild_backoff_max = rebuild_backoff_max
+
+        self._lock = threading.Lock()
+        self._ivf = (None, [])        # (centroids, list of _Cell), swapped as one
+        self._user_cells = {}         # user_id -> set of cell ids
+        self._built_rows = 0
+        self._churn = 0
+        self._rebuilding = False
+        self._pending = None          # writes made while a rebuild is running
+        self._failures = 0            # consecutive failed rebuilds
+        self._retry_at = 0.0          # monotonic time before which no rebuild starts
+        self.rebuilds = 0
+
+    @property
+    def ready(self):
+        return self._ivf[0] is not None
+
+    # --- Build ---
+
+    def build(self, matrix, owners):
+        """
+        Train cells on (N, dim) `matrix` whose rows belong to `owners[i]`.
+        """
+        centroids, cells, user_cells = self._train(matrix, owners)
+        with self._lock:
+            self._install(centroids, cells, user_cells, len(matrix))
+
+    def _train(self, matrix, owners):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        n = len(matrix)
+        nlist = self.nlist or max(1, int(4 * np.sqrt(n)))
+        nlist = min(nlist, n)
+        rng = np.random.default_rng(0)
+
+        # k-means on a sample, enough points per cell for stable centroids
+        sample_size = min(n, nlist * 64)
+        sample = matrix[rng.choice(n, sample_size, replace=False)] if sample_size < n else matrix
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].astype(np.float64)
+        for _ in range(self.kmeans_iters):
+            assign = _nearest(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            nonempty = counts > 0
+            centroids[nonempty] = sums[nonempty] / counts[nonempty, None]
+
+        cells = [_Cell(self.dim) for _ in range(nlist)]
+        user_cells = {}
+        assign = _nearest(matrix, centroids)
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        for cell_id in range(nlist):
+            rows = order[bounds[cell_id]:bounds[cell_id + 1]]
+            if len(rows) == 0:
+                continue
+            cell_owners = [owners[i] for i in rows]
+            cells[cell_id].extend(matrix[rows], cell_owners)
+            for uid in cell_owners:
+                user_cells.setdefault(uid, set()).add(cell_id)
+        return centroids, cells, user_cells
+
+    def _install(self, centroids, cells, user_cells, rows):
+        self._ivf = (centroids, cells)
+        self._user_cells = user_cells
+        self._built_rows = rows
+        self._churn = 0
+
+    def rebuild_async(self, export):
+        """
+        Rebuild in a background thread. `export` returns (matrix, owners)
+        for the current gallery.
+        """
+        with self._lock:
+            if self._rebuilding or time.monotonic() < self._retry_at:
+                return False
+            self._rebuilding = True
+            self._pending = []
+
+        def run():
+            try:
+                matrix, owners = export()
+                centroids, cells, user_cells = self._train(matrix, owners)
+                with self._lock:
+                    self._install(centroids, cells, user_cells, len(matrix))
+                    for op, user_id, encodings in self._pending:
+                        self._remove_locked(user_id)
+                        if op == 'add':
+                            self._add_locked(user_id, encodings)
+                    self.rebuilds += 1
+                    self._failures = 0
+                print(f"IVF index rebuilt: {len(cells)} cells, {len(matrix)} rows")
+            except Exception as e:
+                with self._lock:
+                    self._failures += 1
+                    delay = min(self.rebuild_backoff_max, self.rebuild_backoff * 2 ** (self._failures - 1))
+                    self._retry_at = time.monotonic() + delay
+                print(f"IVF index rebuild failed (retry in {delay:.0f}s): {e}")
+            finally:
+                with self._lock:
+                    self._rebuilding = False
+                    self._pending = None
+
+        threading.Thread(target=run, daemon=True).start()
+        return True
+
+    def needs_rebuild(self):
+        if not self.ready or self._rebuilding:
+            return False
+        if self._churn > self.rebuild_churn * max(self._built_rows, 1):
+            return True
+        sizes = [cell.size for cell in self._ivf[1]]
+        mean = sum(sizes) / max(len(sizes), 1)
+        return mean > 0 and max(sizes) > self.rebuild_imbalance * mean
+
+    # --- Writes ---
+
+    def add(self, user_id, encodings):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('add', user_id, encodings))
+            if not self.ready:
+                return
+            self._remove_locked(user_id)
+            self._add_locked(user_id, encodings)
+
+    def remove(self, user_id):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append(('remove', user_id, None))
+            if not self.ready:
+                return
+            self._remove_locked(user_id)
+
+    def _add_locked(self, user_id, encodings):
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        centroids, cells = self._ivf
+        assign = _nearest(encodings, centroids)
+        for cell_id in np.unique(assign):
+            cells[cell_id].extend(encodings[assign == cell_id], [user_id] * int(np.sum(assign == cell_id)))
+            self._user_cells.setdefault(user_id, set()).add(int(cell_id))
+        self._churn += len(encodings)
+
+    def _remove_locked(self, user_id):
+        cells = self._ivf[1]
+        for cell_id in self._user_cells.pop(user_id, ()):
+            self._churn += cells[cell_id].discard(user_id)
+
+    # --- Search ---
+
+    def candidates(self, probe):
+        """
+        Up to `rerank` distinct user ids likely to be nearest to `probe`.
+        """
+        centroids, cells = self._ivf
+        probe = np.asarray(probe, dtype=np.float32).reshape(1, self.dim)
+        nprobe = min(self.nprobe, len(centroids))
+        cell_dist = _sq_distances(probe, centroids)[0]
+        probed = np.argpartition(cell_dist, nprobe - 1)[:nprobe]
+
+        best = {}
+        for cell_id in probed:
+            vecs, sq_norms, owners = cells[cell_id].view()
+            if len(owners) == 0:
+                continue
+            d = _sq_distances(probe, vecs, sq_norms)[0]
+            k = min(self.rerank, len(d))
+            for i in np.argpartition(d, k - 1)[:k]:
+                uid = owners[i]
+                if uid not in best or d[i] < best[uid]:
+                    best[uid] = d[i]
+        return sorted(best, key=best.get)[:self.rerank]
+
+    def stats(self):
+        sizes = [cell.size for cell in self._ivf[1]]
+        return {
+            "ready": self.ready,
+            "cells": len(sizes),
+            "largest_cell": max(sizes) if sizes else 0,
+            "nprobe": self.nprobe,
+            "rerank": self.rerank,
+            "churn_since_build": self._churn,
+            "rebuilding": self._rebuilding,
+            "rebuilds": self.rebuilds,
+            "failed_rebuilds": self._failures,
+        }
+
+
+class _Cell:
+    """
+    One IVF cell: growable float32 encoding buffer plus the owning user of
+    each row.
+    Appends write into spare capacity; deletes copy into new buffers. Either
+    way the readable rows are then published as one (vecs, sq_norms, owners)
+    tuple, so a concurrent reader never pairs rows with another buffer's
+    owners.
+    """
+
+    def __init__(self, dim):
+        self.dim = dim
+        self._vecs = np.empty((0, dim), dtype=np.float32)
+        self._sq_norms = np.empty(0, dtype=np.float32)
+        self._owners = []
+        self.size = 0
+        self._publish()
+
+    def _publish(self):
+        # owners is only appended to past `size` or replaced, never rewritten
+        n = self.size
+        self._view = (self._vecs[:n], self._sq_norms[:n], self._owners)
+
+    def view(self):
+        return self._view
+
+    def extend(self, vecs, owners):
+        n, extra = self.size, len(vecs)
+        if n + extra > len(self._vecs):
+            capacity = max(n + extra, 2 * len(self._vecs), 16)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown_norms = np.empty(capacity, dtype=np.float32)
+            grown[:n] = self._vecs[:n]
+            grown_norms[:n] = self._sq_norms[:n]
+            self._vecs, self._sq_norms = grown, grown_norms
+        self._vecs[n:n + extra] = vecs
+        self._sq_norms[n:n + extra] = np.einsum('ij,ij->i', vecs, vecs)
+        self._owners.extend(owners)
+        self.size = n + extra
+        self._publish()
+
+    def discard(self, user_id):
+        keep = [i for i, uid in enumerate(self._owners[:self.size]) if uid != user_id]
+        removed = self.size - len(keep)
+        if removed:
+            self._vecs = self._vecs[keep]
+            self._sq_norms = self._sq_norms[keep]
+            self._owners = [self._owners[i] for i in keep]
+            self.size = len(keep)
+            self._publish()
+        return removed
+
+
+def _sq_distances(probes, matrix, sq_norms=None):
+    if sq_norms is None:
+        sq_norms = np.einsum('ij,ij->i', matrix, matrix)
+    return (
+        np.einsum('ij,ij->i', probes, probes)[:, None]
+        + sq_norms[None, :]
+        - 2.0 * (probes @ matrix.T)
+    )
+
+
+def _nearest(points, centroids):
+    return np.argmin(_sq_distances(points, centroids), axis=1)
@@ -1,34 +1,40 @@
 import flask
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-from flask_socketio import SocketIO, emit
-from supabase import create_client, Client
+from flask_socketio import SocketIO
 import face_recognition
-import numpy as np
 import os
-import json
 import base64
-import cv2
 from datetime import datetime, date, timedelta, timezone
-from scipy.spatial import distance as dist
 import pandas as pd
 import io
 from collections import Counter
 from dateutil.relativedelta import relativedelta
 from werkzeug.utils import secure_filename
 from notifications import notification_service # Import Service
-import requests
+from face_gallery import FaceGallery
+from ann_index import IVFIndex
+from gallery_snapshot import load_snapshot, SnapshotWriter
+from gallery_sync import GallerySync, EMPLOYEE_COLUMNS
+from face_detection import FaceDetector
+from frame_pipeline import ClientState, FaceMeshPool, analyze_frame
+from recognition_worker import init_worker, encode_image, enroll_image, decode_image, decode_frame_reduced, frame_header
+from recognition_executor import RecognitionExecutor
+from frame_buffer import LatestFrameBuffer, CLOSED
+from face_tracker import FaceTracker
+from ttl_store import TTLStore, start_sweeper
+from attendance_state import AttendanceStateStore, parse_timestamp
+from config_cache import ConfigCache
+from attendance_spool import AttendanceSpool
+from audit_sink import AuditSink
+from data_store import open_data_store
+import atexit
 import time
-from threading import Thread
-
-# Try importing mediapipe (might fail on Python 3.13 or Apple Silicon)
-try:
-    import mediapipe as mp
-    mp_face_mesh = mp.solutions.face_mesh
-    HAS_MEDIAPIPE = True
-except ImportError:
-    print("Warning: mediapipe not found. Liveness detection will be disabled.")
-    HAS_MEDIAPIPE = False
+import zipfile
+from functools import partial
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from threading import Thread, Lock
 
 from dotenv import load_dotenv
 
@@ -40,98 +46,318 @@ CORS(app)
 # Enable SocketIO with CORS
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='threading')
 
-# --- Liveness Detection Setup ---
-mp_face_mesh = mp.solutions.face_mesh
-# Use a global instance or per-request? Global is better for performance but not thread-safe if processed in parallel?
-# SocketIO threading mode: requests are concurrent. MediaPipe FaceMesh is not strictly thread-safe.
-# However, usually we instantiate it per claim or use a lock.
-# For simplicity in this demo, we can instantiate it inside the processing function or use a pool.
-# Instantiating per frame is expensive.
-# Let's try one global instance and see (Thread safety might be an issue, but standard GIL helps).
-# Better: Create a dictionary of FaceMesh objects keyed by session ID if possible, or just one global guarded by Lock.
-# Actually, let's keep it simple: Instantiate inside the session state object or just once globally and risk it (usually fine for single generic worker).
-
-# Let's use a class to manage state per client
-class ClientState:
-    def __init__(self):
-        self.blink_counter = 0
-        self.total_blinks = 0
-        self.last_blink_time = None
-        self.is_live = False
-        # Initialize FaceMesh per client to avoid thread conflicts and state mixups
-        self.face_mesh = mp_face_mesh.FaceMesh(
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+# Spawned worker processes re-import this file as __mp_main__ when it is run
+# directly; they only need recognition_worker, so skip startup work there
+IS_WORKER_PROCESS = __name__ == "__mp_main__"
 
-# Global state store: { sid: ClientState }
+# Global state store: { sid: ClientState } (in-process recognition only)
 client_states = {}
-
-# Constants for EAR
-EYE_AR_THRESH = 0.25 # Threshold below which eye is considered closed
-EYE_AR_CONSEC_FRAMES = 3 # Increased to 3 to filter out noise
-LIVENESS_TIMEOUT = 5.0 # Seconds liveness remains valid after a blink
-
-# Eye Landmarks (MediaPipe)
-# Left eye indices
-LEFT_EYE = [362, 385, 387, 263, 373, 380]
-# Right eye indices
-RIGHT_EYE = [33, 160, 158, 133, 153, 144]
-
-def calculate_ear(landmarks, indices):
-    # Euclidean distance between vertical eye landmarks
-    A = dist.euclidean(landmarks[indices[1]], landmarks[indices[5]])
-    B = dist.euclidean(landmarks[indices[2]], landmarks[indices[4]])
-    # Euclidean distance between horizontal eye landmarks
-    C = dist.euclidean(landmarks[indices[0]], landmarks[indices[3]])
-    # Compute EAR
-    ear = (A + B) / (2.0 * C)
-    return ear
-
-
-# Supabase Configuration
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-
-# Global storage for face encodings (cache for fast recognition)
-# Structure: { "user_id": { "name": "Name", "encodings": [encoding1, ...] } }
+# FaceMesh instances for liveness, created on first use and shared by all
+# sessions (in-process recognition only; workers have their own)
+face_mesh_pool = FaceMeshPool(
+    size=int(os.getenv("FACEMESH_POOL_SIZE", 4)),
+    timeout=float(os.getenv("FACEMESH_POOL_TIMEOUT", 5.0))
+)
+# Newest unprocessed frame per socket session (older ones are dropped)
+frame_buffer = LatestFrameBuffer()
+# Identified face per socket session, reused across frames: { sid: FaceTracker }
+face_trackers = {}
+TRACK_ENABLED = os.getenv("TRACK_ENABLED", "true").lower() != "false"
+TRACK_IOU_THRESHOLD = float(os.getenv("TRACK_IOU_THRESHOLD", 0.5))
+TRACK_REVERIFY_SECONDS = float(os.getenv("TRACK_REVERIFY_SECONDS", 3.0))
+# Last frame time per socket session. Sessions idle for SESSION_TTL seconds
+# (dropped connections never send 'disconnect'), or the least recently
+# active ones beyond SESSION_MAX, are released like a disconnect.
+active_sessions = TTLStore(
+    ttl=float(os.getenv("SESSION_TTL", 300)),
+    max_size=int(os.getenv("SESSION_MAX", 500)),
+    on_evict=lambda sid, _: close_session(sid),
+    name="sessions"
+)
+
+# Face detection stage (see face_detection.py for the strategies)
+FACE_DETECTION_CONFIG = {
+    "strategy": os.getenv("FACE_DETECTION_STRATEGY", "hog"),
+    "scale": float(os.getenv("FACE_DETECTION_SCALE", 0.5)),
+    "upsample": int(os.getenv("FACE_DETECTION_UPSAMPLE", 1)),
+    "model": os.getenv("FACE_DETECTION_MODEL", "hog"),
+    "dnn_prototxt": os.getenv("FACE_DNN_PROTOTXT"),
+    "dnn_model": os.getenv("FACE_DNN_MODEL"),
+    "dnn_confidence": float(os.getenv("FACE_DNN_CONFIDENCE", 0.6))
+}
+face_detector = FaceDetector(**FACE_DETECTION_CONFIG)
+# Where live frames get their face box from:
+#   detector - run face_detector on every frame
+#   facemesh - reuse the FaceMesh landmarks of the liveness check and only
+#              fall back to face_detector when FaceMesh finds no face
+FACE_LOCATION_SOURCE = os.getenv("FACE_LOCATION_SOURCE", "detector").lower()
+# Live JPEG frames are decoded at 1/N resolution (1, 2, 4 or 8) for liveness
+# and detection; the full frame is only decoded when a face needs encoding
+FRAME_DECODE_SCALE = int(os.getenv("FRAME_DECODE_SCALE", 1))
+# Without mediapipe, live frames are refused ("Liveness unavailable") unless
+# liveness is explicitly turned off here
+LIVENESS_REQUIRED = os.getenv("LIVENESS_REQUIRED", "true").lower() != "false"
+
+# Live frames can be analysed in worker processes instead of this one
+# (0 = in-process). Each socket session is pinned to one worker, which keeps
+# that session's liveness state.
+RECOGNITION_WORKERS = int(os.getenv("RECOGNITION_WORKERS", 0))
+recognition_executor = None
+if RECOGNITION_WORKERS > 0 and not IS_WORKER_PROCESS:
+    recognition_executor = RecognitionExecutor(
+        RECOGNITION_WORKERS, FACE_DETECTION_CONFIG, FACE_LOCATION_SOURCE, FRAME_DECODE_SCALE,
+        liveness_required=LIVENESS_REQUIRED
+    )
+
+# Process pool for /verify/batch (decode + detection + encoding per image)
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", os.cpu_count() or 2))
+BATCH_MAX_IMAGES = int(os.getenv("BATCH_MAX_IMAGES", 200))
+# Uncompressed size limits for zip uploads, checked before anything is
+# extracted: per entry, and for the whole archive
+BATCH_MAX_IMAGE_BYTES = int(os.getenv("BATCH_MAX_IMAGE_BYTES", 10 * 1024 * 1024))
+BATCH_MAX_ARCHIVE_BYTES = int(os.getenv("BATCH_MAX_ARCHIVE_BYTES", 200 * 1024 * 1024))
+_batch_pool = None
+_batch_pool_lock = Lock()
+
+# Enrollment (/register): photos are scored for face size, sharpness and pose
+# on the batch pool; at least ENROLL_MIN_PHOTOS must pass and the best
+# ENROLL_MAX_TEMPLATES are stored
+ENROLL_MIN_PHOTOS = int(os.getenv("ENROLL_MIN_PHOTOS", 3))
+ENROLL_MAX_TEMPLATES = int(os.getenv("ENROLL_MAX_TEMPLATES", 5))
+ENROLL_LIMITS = {
+    "min_face_px": int(os.getenv("ENROLL_MIN_FACE_PX", 80)),
+    "min_sharpness": float(os.getenv("ENROLL_MIN_SHARPNESS", 60.0)),
+    "max_yaw": float(os.getenv("ENROLL_MAX_YAW", 0.35)),
+    "max_roll": float(os.getenv("ENROLL_MAX_ROLL", 20.0))
+}
+
+def get_batch_pool():
+    global _batch_pool
+    with _batch_pool_lock:
+        if _batch_pool is None:
+            # spawn: workers only import recognition_worker, not this app
+            _batch_pool = ProcessPoolExecutor(
+                max_workers=BATCH_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(FACE_DETECTION_CONFIG,)
+            )
+        return _batch_pool
+
+# Data store: Supabase, or a local SQLite database with DATA_BACKEND=sqlite
+supabase = open_data_store()
+
+# Global storage for employee details (name / phone) of everyone with a face
+# Structure: { "user_id": { "name": "Name", "phone_number": "628..." } }
 known_faces_cache = {}
-# Debounce cache: { "user_id": timestamp }
-last_processed_cache = {}
+# All face encodings in one contiguous matrix for batched matching
+# FACE_INDEX_MODE=ivf adds an approximate index for very large galleries
+# (nprobe = recall/speed knob, rerank = candidates re-checked exactly)
+FACE_INDEX_MODE = os.getenv("FACE_INDEX_MODE", "exact").lower()
+# Encoding storage: float64 (default), float32 or int8 (scalar-quantized)
+FACE_GALLERY_DTYPE = os.getenv("FACE_GALLERY_DTYPE", "float64").lower()
+if FACE_INDEX_MODE == "ivf":
+    face_gallery = FaceGallery(dtype=FACE_GALLERY_DTYPE, ann=IVFIndex(
+        128,
+        nlist=int(os.getenv("FACE_IVF_NLIST", 0)),
+        nprobe=int(os.getenv("FACE_IVF_NPROBE", 8)),
+        rerank=int(os.getenv("FACE_IVF_RERANK", 32)),
+        min_rows=int(os.getenv("FACE_IVF_MIN_ROWS", 2048))
+    ))
+else:
+    face_gallery = FaceGallery(dtype=FACE_GALLERY_DTYPE)
+# Matching threshold (face_recognition tolerance and max mean distance)
+FACE_MATCH_TOLERANCE = 0.5
+# Enrollment is refused when an encoding is this close to another employee's
+DUPLICATE_THRESHOLD = float(os.getenv("DUPLICATE_THRESHOLD", 0.45))
+# Last whole-gallery duplicate scan (POST /employees/duplicates)
+duplicate_scan = {"status": "idle"}
+duplicate_scan_lock = Lock()
+# Debounce cache: { "user_id": timestamp }, entries only matter for the cooldown
+last_processed_cache = TTLStore(
+    ttl=float(os.getenv("COOLDOWN_CACHE_TTL", 600)),
+    max_size=int(os.getenv("COOLDOWN_CACHE_MAX", 10000)),
+    name="cooldown"
+)
+
+# On-disk gallery snapshot (memory-mapped at startup, shared by all workers)
+GALLERY_SNAPSHOT_DIR = os.getenv("GALLERY_SNAPSHOT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "gallery_snapshot"))
+GALLERY_SNAPSHOT_MAX_AGE = float(os.getenv("GALLERY_SNAPSHOT_MAX_AGE", 24 * 3600))
+
+def cache_employee(emp):
+    """
+    Add or refresh one employee row (id, name, phone_number, face_encoding)
+    in the local cache. Employees without a face are removed.
+    """
+    user_id = emp['id']
+    # Supabase stores JSON, so we get a list of lists (encodings) directly
+    raw_encodings = emp.get('face_encoding')
+    if not raw_encodings:
+        uncache_employee(user_id)
+        return False
+
+    known_faces_cache[user_id] = {
+        "name": emp['name'],
+        "phone_number": emp.get('phone_number') # Get phone number
+    }
+    # Skip the (compacting) gallery write when the encodings did not change
+    if not face_gallery.same_encodings(user_id, raw_encodings):
+        face_gallery.add(user_id, raw_encodings)
+    return True
+
+def uncache_employee(user_id):
+    face_gallery.remove(user_id)
+    if known_faces_cache.pop(user_id, None) is not None:
+        print(f"Removed user {user_id} from cache.")
+
+def sync_upsert(emp):
+    cache_employee(emp)
+    snapshot_writer.schedule()
+
+def sync_delete(user_id):
+    uncache_employee(user_id)
+    snapshot_writer.schedule()
+
+# Delta sync from the employee_changes log (gallery_sync_migration.sql)
+gallery_sync = GallerySync(
+    supabase, sync_upsert, sync_delete,
+    interval=float(os.getenv("GALLERY_SYNC_INTERVAL", 30)),
+    gap_timeout=float(os.getenv("GALLERY_SYNC_GAP_TIMEOUT", 300))
+)
+snapshot_writer = SnapshotWriter(GALLERY_SNAPSHOT_DIR, face_gallery, known_faces_cache, version_getter=lambda: gallery_sync.version)
 
 def load_data_from_supabase():
     global known_faces_cache
     print("Loading data from Supabase...")
     try:
-        response = supabase.table('employees').select("*").execute()
+        response = supabase.table('employees').select(EMPLOYEE_COLUMNS).execute()
         employees = response.data
+
+        if face_gallery.quantized and len(face_gallery) == 0:
+            # Fit the int8 scale to the real value range before quantizing
+            face_gallery.calibrate([e for emp in employees for e in (emp.get('face_encoding') or [])])
         
         count = 0
         for emp in employees:
-            user_id = emp['id']
-            name = emp['name']
-            # Supabase stores JSON, so we get a list of lists (encodings) directly
-            # We need to convert them back to numpy arrays for face_recognition
-            raw_encodings = emp['face_encoding'] 
-            phone_number = emp.get('phone_number') # Get phone number
-
-            if raw_encodings:
-                encodings = [np.array(e) for e in raw_encodings]
-                known_faces_cache[user_id] = {
-                    "name": name,
-                    "phone_number": phone_number,
-                    "encodings": encodings
-                }
+            if cache_employee(emp):
                 count += 1
         print(f"Loaded {count} users from Supabase.")
+        return True
     except Exception as e:
         print(f"Error loading from Supabase: {e}")
+        return False
+
+def load_gallery():
+    """
+    Map the gallery snapshot if it is fresh, otherwise do a full Supabase load
+    and write a new snapshot for the next start. With delta sync available, a
+    snapshot only has to catch up on the changes made since it was written.
+    """
+    # Read the change-log head before loading anything, so changes made
+    # during the load are picked up by the next sync
+    gallery_sync.init_version()
+
+    face_count = None
+    if not gallery_sync.enabled:
+        # Cheap freshness check: number of employees that have a face
+        try:
+            res = supabase.table('employees').select("id", count='exact').not_.is_('face_encoding', 'null').limit(1).execute()
+            face_count = res.count
+        except Exception as e:
+            # Database unreachable: a possibly stale snapshot beats an empty gallery
+            print(f"Could not count employees, using snapshot as-is: {e}")
+
+    snapshot = load_snapshot(GALLERY_SNAPSHOT_DIR, max_age=GALLERY_SNAPSHOT_MAX_AGE, source_count=face_count, dtype=face_gallery.dtype)
+    if snapshot and gallery_sync.enabled and snapshot[0].get("sync_version") is None:
+        # Written without sync info, cannot tell what it is missing
+        snapshot = None
+    if snapshot:
+        sidecar, matrix, sq_norms = snapshot
+        users = sidecar["users"]
+        for u in users:
+            known_faces_cache[u["id"]] = {"name": u["name"], "phone_number": u["phone_number"]}
+        face_gallery.load(
+            matrix, sq_norms,
+            [u["start"] for u in users],
+            [u["count"] for u in users],
+            [u["id"] for u in users],
+            scale=sidecar.get("scale")
+        )
+        print(f"Loaded {len(users)} users from gallery snapshot.")
+        if gallery_sync.enabled:
+            gallery_sync.version = sidecar["sync_version"]
+            try:
+                gallery_sync.sync_once()
+                print(f"Gallery caught up to sync version {gallery_sync.version}.")
+            except Exception as e:
+                print(f"Gallery catch-up failed, will retry in background: {e}")
+        return
+
+    if load_data_from_supabase():
+        snapshot_writer.write_now()
+
+# Settings, shifts and employee -> shift, invalidated by the endpoints that change them
+config_cache = ConfigCache(supabase, ttl=float(os.getenv("CONFIG_CACHE_TTL", 300)))
+
+# Latest attendance log per employee, instead of a lookback query per match
+ATTENDANCE_LOOKBACK_HOURS = 20
+attendance_state = AttendanceStateStore(
+    supabase,
+    lookback_hours=ATTENDANCE_LOOKBACK_HOURS,
+    reconcile_interval=float(os.getenv("ATTENDANCE_RECONCILE_INTERVAL", 300))
+)
+
+# Write-behind attendance inserts: recognised check-ins are spooled to local
+# SQLite and flushed to Supabase in batches (ATTENDANCE_WRITE_BEHIND=false
+# inserts synchronously as before)
+ATTENDANCE_WRITE_BEHIND = os.getenv("ATTENDANCE_WRITE_BEHIND", "true").lower() != "false"
+attendance_spool = None
+if ATTENDANCE_WRITE_BEHIND and not IS_WORKER_PROCESS:
+    attendance_spool = AttendanceSpool(
+        supabase,
+        os.getenv("ATTENDANCE_SPOOL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "attendance_spool.db")),
+        batch_size=int(os.getenv("ATTENDANCE_SPOOL_BATCH", 200)),
+        interval=float(os.getenv("ATTENDANCE_SPOOL_INTERVAL", 1.0))
+    )
+    # Unflushed check-ins count as the latest state on every reload
+    attendance_state.pending = attendance_spool.pending_logs
+
+# Audit log entries are buffered and bulk-inserted in the background
+audit_sink = AuditSink(
+    supabase,
+    batch_size=int(os.getenv("AUDIT_BATCH_SIZE", 50)),
+    interval=float(os.getenv("AUDIT_FLUSH_INTERVAL", 2.0))
+)
 
 # Load data on startup
-load_data_from_supabase()
+if not IS_WORKER_PROCESS:
+    load_gallery()
+    gallery_sync.start()
+    try:
+        attendance_state.warm()
+    except Exception as e:
+        print(f"Attendance state warm-up failed, using per-scan queries until reconcile: {e}")
+    attendance_state.start()
+    if attendance_spool is not None:
+        attendance_spool.start()
+
+        def flush_spool():
+            try:
+                attendance_spool.flush()
+            except Exception as e:
+                print(f"Attendance spool: {attendance_spool.stats()['depth']} log(s) left for next start: {e}")
+        atexit.register(flush_spool)
+
+    audit_sink.start()
+
+    def flush_audit():
+        try:
+            audit_sink.flush()
+        except Exception as e:
+            print(f"Audit logs lost at shutdown ({audit_sink.stats()['pending']}): {e}")
+    atexit.register(flush_audit)
+    atexit.register(notification_service.close, float(os.getenv("NOTIFY_SHUTDOWN_TIMEOUT", 10)))
+    start_sweeper([active_sessions, last_processed_cache, config_cache], interval=float(os.getenv("STORE_SWEEP_INTERVAL", 30)))
 
 # --- ✅ NEW: Root Health-Check Route (tidak mengganggu logika lain) ---
 @app.route('/')
@@ -143,19 +369,67 @@ def health_check():
         "flask_version": flask.__version__,
         "uptime": datetime.now().isoformat(),
         "cached_users": len(known_faces_cache),
+        "gallery_dtype": face_gallery.dtype,
+        "gallery_bytes": face_gallery.memory_bytes(),
+        "face_index": face_gallery.ann.stats() if face_gallery.ann else "exact",
+        "frame_decode_scale": FRAME_DECODE_SCALE,
+        "gallery_sync_version": gallery_sync.version,
+        "gallery_sync": gallery_sync.stats(),
         "endpoints": [
             "POST /register",
             "POST /verify",
+            "POST /verify/batch",
             "GET /stats",
             "GET /reports",
             "GET /employees",
+            "GET,POST /employees/duplicates",
             "GET,POST /settings",
+            "GET /metrics",
+            "POST /detection/benchmark",
             "WebSocket: /socket.io"
         ],
         "note": "This API does not serve a web UI. Use endpoints directly."
     }), 200
 
 
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return jsonify({
+        "detection": face_detector.stats(),
+        "recognition_workers": recognition_executor.stats() if recognition_executor else None,
+        "frames": frame_buffer.stats(),
+        "face_mesh_pool": face_mesh_pool.stats(),
+        "tracking": FaceTracker.stats(),
+        "attendance_state": attendance_state.stats(),
+        "config_cache": config_cache.stats(),
+        "attendance_spool": attendance_spool.stats() if attendance_spool else None,
+        "notifications": notification_service.stats(),
+        "audit": audit_sink.stats(),
+        "stores": {
+            "sessions": active_sessions.stats(),
+            "cooldown": last_processed_cache.stats(),
+            "client_states": len(client_states),
+            "face_trackers": len(face_trackers)
+        }
+    })
+
+@app.route('/detection/benchmark', methods=['POST'])
+def detection_benchmark():
+    """
+    Time every available detection strategy on an uploaded frame
+    to choose FACE_DETECTION_STRATEGY for a deployment.
+    """
+    try:
+        if 'image' not in request.files:
+            return jsonify({"success": False, "error": "No image provided"}), 400
+        image = face_recognition.load_image_file(request.files['image'])
+        runs = int(request.args.get('runs', 3))
+        return jsonify({"success": True, "current": face_detector.strategy, "results": face_detector.benchmark(image, runs)})
+    except Exception as e:
+        print(f"Detection benchmark error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 # --- HTTP Endpoints ---
 
 @app.route('/login', methods=['POST'])
@@ -209,23 +483,63 @@ def register():
         if not name or not user_id:
             return jsonify({"success": False, "error": "Name and ID required"}), 400
 
-        files = request.files
-        if len(files) < 3:
-             return jsonify({"success": False, "error": "3 photos required"}), 400
-
-        new_encodings = []
-
-        for key, file in files.items():
-            image = face_recognition.load_image_file(file)
-            encodings = face_recognition.face_encodings(image)
-            
-            if len(encodings) > 0:
-                new_encodings.append(encodings[0])
-            else:
-                 return jsonify({"success": False, "error": f"No face detected in {key}"}), 400
+        files = [(key, file.filename or key, file.read()) for key, file in request.files.items()]
+        if len(files) < ENROLL_MIN_PHOTOS:
+             return jsonify({"success": False, "error": f"{ENROLL_MIN_PHOTOS} photos required"}), 400
+
+        # Decode, detection, quality scoring and encoding run concurrently
+        start = time.perf_counter()
+        processed = list(get_batch_pool().map(partial(enroll_image, limits=ENROLL_LIMITS), [data for _, _, data in files]))
+        enroll_ms = (time.perf_counter() - start) * 1000
+
+        photos = []
+        for (key, filename, _), r in zip(files, processed):
+            photos.append({
+                "field": key,
+                "filename": filename,
+                "faces": r["faces"],
+                "error": r["error"],
+                "quality": r["quality"],
+                "timing_ms": r["timing_ms"],
+                "kept": False
+            })
 
-        if len(new_encodings) < 3:
-             return jsonify({"success": False, "error": "Could not detect face in all 3 photos"}), 400
+        # Best-scored usable photos become the templates
+        usable = [
+            i for i, r in enumerate(processed)
+            if r["encoding"] is not None and r["quality"]["accepted"]
+        ]
+        usable.sort(key=lambda i: processed[i]["quality"]["score"], reverse=True)
+        if len(usable) < ENROLL_MIN_PHOTOS:
+            return jsonify({
+                "success": False,
+                "error": f"Only {len(usable)} of {len(files)} photos passed the quality check ({ENROLL_MIN_PHOTOS} required)",
+                "photos": photos
+            }), 400
+
+        kept = usable[:ENROLL_MAX_TEMPLATES]
+        for i in kept:
+            photos[i]["kept"] = True
+        new_encodings = [processed[i]["encoding"] for i in kept]
+
+        # Same face already registered under another ID?
+        if request.form.get('allow_duplicate', 'false').lower() != 'true':
+            conflicts = face_gallery.near_duplicates(new_encodings, threshold=DUPLICATE_THRESHOLD, exclude=user_id)
+            if conflicts:
+                return jsonify({
+                    "success": False,
+                    "error": "Face already registered under another ID",
+                    "conflicts": [
+                        {
+                            "id": uid,
+                            "name": known_faces_cache.get(uid, {}).get("name"),
+                            "min_distance": round(min_d, 4),
+                            "mean_distance": round(mean_d, 4)
+                        }
+                        for uid, min_d, mean_d in conflicts
+                    ],
+                    "photos": photos
+                }), 409
 
         # Convert numpy arrays to lists for JSON serialization
         encodings_list = [e.tolist() for e in new_encodings]
@@ -242,15 +556,23 @@ def register():
         # 2. Update Local Cache
         known_faces_cache[user_id] = {
             "name": name,
-            "phone_number": phone, # Cache phone
-            "encodings": new_encodings
+            "phone_number": phone # Cache phone
         }
+        face_gallery.add(user_id, new_encodings)
+        snapshot_writer.schedule()
         
         # --- Notification: Registration Success ---
         if phone:
             notification_service.notify_registration_success(name, phone)
 
-        return jsonify({"success": True, "userId": user_id, "message": "User registered successfully"})
+        return jsonify({
+            "success": True,
+            "userId": user_id,
+            "message": "User registered successfully",
+            "templates": len(new_encodings),
+            "photos": photos,
+            "timing_ms": {"enroll": round(enroll_ms, 2)}
+        })
 
     except Exception as e:
         print(f"Registration error: {e}")
@@ -270,6 +592,81 @@ def verify():
         print(f"Verification error: {e}")
         return jsonify({"success": False, "error": str(e)}), 500
 
+@app.route('/verify/batch', methods=['POST'])
+def verify_batch():
+    """
+    Verify many frames in one request.
+
+    Accepts any number of image files (results keep upload order) and/or a
+    zip archive in the 'archive' field (entries in name order). Decoding and
+    encoding are fanned out over a process pool, then all probes are matched
+    against the gallery in one vectorised step. Pass ?record=false to only
+    identify faces without logging attendance.
+    """
+    try:
+        too_many = jsonify({"success": False, "error": f"Too many images (max {BATCH_MAX_IMAGES})"}), 400
+        items = [] # (filename, bytes)
+        for key, file in request.files.items(multi=True):
+            if key == 'archive':
+                with zipfile.ZipFile(file) as zf:
+                    # Judge the archive by its directory before reading any entry
+                    entries = sorted((i for i in zf.infolist() if not i.is_dir()), key=lambda i: i.filename)
+                    if len(items) + len(entries) > BATCH_MAX_IMAGES:
+                        return too_many
+                    if any(i.file_size > BATCH_MAX_IMAGE_BYTES for i in entries):
+                        return jsonify({"success": False, "error": f"Archive entry too large (max {BATCH_MAX_IMAGE_BYTES} bytes)"}), 400
+                    if sum(i.file_size for i in entries) > BATCH_MAX_ARCHIVE_BYTES:
+                        return jsonify({"success": False, "error": f"Archive too large (max {BATCH_MAX_ARCHIVE_BYTES} bytes uncompressed)"}), 400
+                    for info in entries:
+                        # zipfile stops at the declared file_size, so the limits hold
+                        items.append((info.filename, zf.read(info)))
+            else:
+                items.append((file.filename or key, file.read()))
+
+        if not items:
+            return jsonify({"success": False, "error": "No images provided"}), 400
+        if len(items) > BATCH_MAX_IMAGES:
+            return too_many
+
+        record = request.args.get('record', 'true').lower() != 'false'
+
+        start = time.perf_counter()
+        encoded = list(get_batch_pool().map(encode_image, [data for _, data in items]))
+        encode_ms = (time.perf_counter() - start) * 1000
+
+        start = time.perf_counter()
+        probes = [r["encoding"] for r in encoded if r["encoding"] is not None]
+        matches = iter(face_gallery.match_many(probes, tolerance=FACE_MATCH_TOLERANCE))
+        match_ms = (time.perf_counter() - start) * 1000
+
+        results = []
+        for index, ((filename, _), r) in enumerate(zip(items, encoded)):
+            entry = {"index": index, "filename": filename, "timing_ms": r["timing_ms"]}
+            if r["encoding"] is None:
+                entry.update({"success": False, "error": r["error"]})
+            else:
+                user_id, distance = next(matches)
+                name = known_faces_cache.get(user_id, {}).get("name") if user_id is not None else None
+                if not name:
+                    entry.update({"success": False, "error": "Unknown face"})
+                elif record:
+                    entry.update(record_recognition(user_id, name, distance))
+                else:
+                    entry.update({"success": True, "user": {"id": user_id, "name": name}, "distance": distance})
+            results.append(entry)
+
+        return jsonify({
+            "success": True,
+            "count": len(results),
+            "results": results,
+            "timing_ms": {"encode": round(encode_ms, 2), "match": round(match_ms, 2)}
+        })
+    except zipfile.BadZipFile as e:
+        return jsonify({"success": False, "error": f"Invalid archive: {e}"}), 400
+    except Exception as e:
+        print(f"Batch verification error: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
 @app.route('/stats', methods=['GET'])
 def get_stats():
     try:
@@ -400,6 +797,48 @@ def get_employees():
         print(f"Error fetching employees: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/employees/duplicates', methods=['GET', 'POST'])
+def employee_duplicates():
+    """
+    POST starts a scan of the whole gallery for faces registered under more
+    than one ID (runs in the background); GET returns the last scan.
+    """
+    if request.method == 'GET':
+        with duplicate_scan_lock:
+            return jsonify(duplicate_scan)
+
+    threshold = float(request.args.get('threshold', DUPLICATE_THRESHOLD))
+    with duplicate_scan_lock:
+        if duplicate_scan["status"] == "running":
+            return jsonify(duplicate_scan), 409
+        duplicate_scan.clear()
+        duplicate_scan.update({"status": "running", "threshold": threshold, "started_at": datetime.now().isoformat()})
+
+    def run():
+        start = time.perf_counter()
+        try:
+            clusters = face_gallery.duplicate_clusters(threshold=threshold)
+            result = {
+                "status": "done",
+                "clusters": [
+                    {
+                        "ids": c["ids"],
+                        "names": [known_faces_cache.get(uid, {}).get("name") for uid in c["ids"]],
+                        "pairs": [{"a": a, "b": b, "distance": round(d, 4)} for a, b, d in c["pairs"]]
+                    }
+                    for c in clusters
+                ]
+            }
+        except Exception as e:
+            print(f"Duplicate scan error: {e}")
+            result = {"status": "failed", "error": str(e)}
+        result["duration_ms"] = round((time.perf_counter() - start) * 1000, 2)
+        with duplicate_scan_lock:
+            duplicate_scan.update(result)
+
+    Thread(target=run, daemon=True).start()
+    return jsonify({"success": True, "status": "running"}), 202
+
 @app.route('/employees/<id>', methods=['PUT'])
 def update_employee(id):
     try:
@@ -422,6 +861,8 @@ def update_employee(id):
              return jsonify({"success": True, "message": "No changes"})
 
         supabase.table('employees').update(updates).eq('id', id).execute()
+        if 'shift_id' in updates:
+            config_cache.invalidate_employee(id)
         
         # --- Notification: Shift Change ---
         if 'shift_id' in updates:
@@ -461,13 +902,9 @@ def delete_employee(id):
         response = supabase.table('employees').delete().eq('id', id).execute()
         
         # 2. Remove from Local Cache
-        if id in known_faces_cache:
-            del known_faces_cache[id]
-            print(f"Removed user {id} from cache.")
-
-        if id in known_faces_cache:
-            del known_faces_cache[id]
-            print(f"Removed user {id} from cache.")
+        uncache_employee(id)
+        snapshot_writer.schedule()
+        attendance_state.forget(id)
 
         # --- Audit Log ---
         actor_name = request.args.get('actor_name', 'Admin')
@@ -507,6 +944,7 @@ def handle_settings():
             # Upsert id=1
             update_data['id'] = 1
             supabase.table('attendance_settings').upsert(update_data).execute()
+            config_cache.invalidate_settings()
             return jsonify({"success": True})
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
@@ -534,6 +972,7 @@ def handle_shifts():
                  supabase.table('shifts').update(shift).eq('id', data['id']).execute()
             else: # Insert
                  supabase.table('shifts').insert(shift).execute()
+            config_cache.invalidate_shifts()
             return jsonify({"success": True})
         except Exception as e:
             return jsonify({"success": False, "error": str(e)}), 500
@@ -542,8 +981,7 @@ def handle_shifts():
 def delete_shift(id):
     try:
         supabase.table('shifts').delete().eq('id', id).execute()
-        
-        supabase.table('shifts').delete().eq('id', id).execute()
+        config_cache.invalidate_shifts()
         
         # --- Audit Log ---
         actor_name = request.args.get('actor_name', 'Admin')
@@ -656,18 +1094,8 @@ def manual_attendance():
             "confidence_score": 1.0
         }
         supabase.table('attendance_logs').insert(log).execute()
-        
-        shift_id = emp_res.data[0]['shift_id'] if emp_res.data else None
-
-        # 2. Insert log with shift_id
-        log = {
-            "employee_id": employee_id,
-            "timestamp": timestamp,
-            "status": status,
-            "shift_id": shift_id, # Store historical shift
-            "confidence_score": 1.0
-        }
-        supabase.table('attendance_logs').insert(log).execute()
+        if timestamp:
+            attendance_state.record(employee_id, status, timestamp, shift_id)
         
         # --- Audit Log ---
         actor_name = data.get('actor_name', 'Admin')
@@ -973,6 +1401,12 @@ def get_audit_logs():
     try:
         # Default fetch last 50
         limit = request.args.get('limit', 50)
+
+        # Include entries still waiting in the audit buffer
+        try:
+            audit_sink.flush()
+        except Exception as e:
+            print(f"Audit flush before read failed: {e}")
         
         response = supabase.table('audit_logs')\
             .select("*")\
@@ -988,31 +1422,17 @@ def get_audit_logs():
 # --- Helper Functions ---
 
 def get_current_schedule():
-    try:
-        response = supabase.table('attendance_settings').select("*").eq('id', 1).execute()
-        if response.data:
-            return response.data[0]
-        return {"start_time": "08:00", "end_time": "17:00", "late_tolerance_minutes": 15}
-    except:
-        return {"start_time": "08:00", "end_time": "17:00", "late_tolerance_minutes": 15}
+    # Cached, with start/end times already parsed (see config_cache.py)
+    return config_cache.schedule()
 
 def log_activity(actor_name, action, target_id=None, details=None):
     """
-    Helper to insert audit log
+    Helper to insert audit log (buffered, written in bulk by audit_sink)
     """
-    try:
-        log_data = {
-            "actor_name": actor_name,
-            "action": action,
-            "target_id": target_id,
-            "details": details or {}
-        }
-        supabase.table('audit_logs').insert(log_data).execute()
-        print(f"Audit Log: {actor_name} -> {action}")
-    except Exception as e:
-        print(f"Failed to create audit log: {e}")
+    audit_sink.log(actor_name, action, target_id=target_id, details=details)
+    print(f"Audit Log: {actor_name} -> {action}")
 
-def process_image_for_recognition(image, sid=None):
+def process_image_for_recognition(image, sid=None, full_frame=None, scale=1):
     # 0. Get Client State
     state = None
     if sid:
@@ -1020,108 +1440,90 @@ def process_image_for_recognition(image, sid=None):
             client_states[sid] = ClientState()
         state = client_states[sid]
 
-    liveness_status = "Unknown"
-    
-    # 1. Liveness Detection (MediaPipe)
-    if state:
-        # Check if liveness is still valid
-        if state.last_blink_time and (datetime.now() - state.last_blink_time).total_seconds() < LIVENESS_TIMEOUT:
-            state.is_live = True
-        else:
-            state.is_live = False
-
-        # Process frame for blinks
-        # MediaPipe needs RGB (already converted)
-        results = state.face_mesh.process(image)
-        
-        if results.multi_face_landmarks:
-            for face_landmarks in results.multi_face_landmarks:
-                # Convert landmarks to numpy array for easier indexing if needed, 
-                # but we can access .x .y directly.
-                # However, calculate_ear uses indices on a list of (x,y) tuples usually.
-                # Let's extract coords.
-                h, w, _ = image.shape
-                landmarks = [(lm.x * w, lm.y * h) for lm in face_landmarks.landmark]
-                
-                leftEAR = calculate_ear(landmarks, LEFT_EYE)
-                rightEAR = calculate_ear(landmarks, RIGHT_EYE)
-                ear = (leftEAR + rightEAR) / 2.0
-                # print(f"EAR: {ear:.2f} | Count: {state.blink_counter}") # Debug EAR
-                
-                if ear < EYE_AR_THRESH:
-                    state.blink_counter += 1
-                else:
-                    if state.blink_counter >= EYE_AR_CONSEC_FRAMES:
-                        state.total_blinks += 1
-                        state.last_blink_time = datetime.now()
-                        state.is_live = True # Liveness confirmed!
-                        print(f"Blink detected! Total: {state.total_blinks}")
-                    state.blink_counter = 0
-        
-        liveness_status = "Live" if state.is_live else "Spoof/Photo - Please Blink"
-
-    # If NOT live, we can choose to return early or return a specific status
-    # To secure it: strictly block recognition if not live.
-    if state and not state.is_live:
-         return {
-            "success": False, 
-            "error": "Liveness Check Failed",
-            "message": "Silakan berkedip untuk verifikasi.",
-            "is_live": False
-        }
+    tracker = get_tracker(sid)
+    track_box = tracker.hint() if tracker else None
+
+    # 1. Liveness + 2. Face detection / encoding
+    encoding, failure, location = analyze_frame(
+        image, state, face_detector, FACE_LOCATION_SOURCE,
+        track_box=track_box, track_iou=TRACK_IOU_THRESHOLD,
+        full_frame=full_frame, scale=scale, mesh_pool=face_mesh_pool,
+        liveness_required=LIVENESS_REQUIRED
+    )
+    return finish_recognition(encoding, failure, location, tracker)
+
+def get_tracker(sid):
+    if not sid or not TRACK_ENABLED:
+        return None
+    tracker = face_trackers.get(sid)
+    if tracker is None:
+        tracker = face_trackers[sid] = FaceTracker(TRACK_IOU_THRESHOLD, TRACK_REVERIFY_SECONDS)
+    return tracker
+
+def finish_recognition(encoding, failure, location, tracker=None):
+    """
+    Turn a frame_pipeline.analyze_frame result into the attendance response.
+    """
+    if failure:
+        if tracker:
+            tracker.lose()
+        return failure
 
-    # 2. Face Recognition (dlib)
-    # Only proceed if live
-    
-    face_locations = face_recognition.face_locations(image)
-    face_encodings = face_recognition.face_encodings(image, face_locations)
+    if encoding is None and tracker:
+        # Face continues the tracked identity: no encoding / matching needed
+        user_id, name, distance = tracker.follow(location)
+        return record_recognition(user_id, name, distance)
 
-    if not face_encodings:
-         return {"success": False, "error": "No face detected", "is_live": state.is_live if state else False}
+    return match_and_record(encoding, location, tracker)
 
-    unknown_encoding = face_encodings[0]
-    
+def match_and_record(unknown_encoding, location=None, tracker=None):
     best_match_name = None
-    best_match_id = None
-    min_distance = 0.5 
-
-    for user_id, data in known_faces_cache.items():
-        stored_encodings = data["encodings"]
-        # Use tolerance 0.5 for strict matching
-        matches = face_recognition.compare_faces(stored_encodings, unknown_encoding, tolerance=0.5)
-        face_distances = face_recognition.face_distance(stored_encodings, unknown_encoding)
-        
-        if True in matches:
-            avg_distance = np.mean(face_distances)
-            if avg_distance < min_distance:
-                min_distance = avg_distance
-                best_match_name = data["name"]
-                best_match_id = user_id
+    # Single batched distance computation against the whole gallery
+    # Use tolerance 0.5 for strict matching
+    best_match_id, min_distance = face_gallery.match(unknown_encoding, tolerance=FACE_MATCH_TOLERANCE)
+    if best_match_id is not None:
+        best_match_name = known_faces_cache.get(best_match_id, {}).get("name")
+
+    if tracker:
+        tracker.identified(location, best_match_id if best_match_name else None, best_match_name, min_distance)
 
     if best_match_name:
-        # Debounce/Cooldown Check (e.g., 5 seconds)
-        last_time = last_processed_cache.get(best_match_id)
-        current_time = datetime.now()
-        
-        if last_time and (current_time - last_time).total_seconds() < 5:
-            # Skip processing if too soon
-            return {
-                "success": True, 
-                "user": {
-                    "id": best_match_id, 
-                    "name": best_match_name, 
-                    "time": current_time.isoformat(), 
-                    "status": "Cooldown" 
-                },
-                "is_live": True
-            }
-        
-        last_processed_cache[best_match_id] = current_time
+        return record_recognition(best_match_id, best_match_name, min_distance)
+    else:
+         return {"success": False, "error": "Unknown face", "is_live": True}
 
-        # Check recent attendance for this user (Lookback 20 hours to cover night shifts/timezone diffs)
-        lookback_time = (datetime.now(timezone.utc) - timedelta(hours=20)).isoformat()
-        
-        try:
+def record_recognition(best_match_id, best_match_name, min_distance):
+    """
+    Attendance logic for one recognised employee: cooldown, check-in/out
+    decision, attendance log insert and notifications.
+    """
+    # Debounce/Cooldown Check (e.g., 5 seconds)
+    last_time = last_processed_cache.get(best_match_id)
+    current_time = datetime.now()
+    
+    if last_time and (current_time - last_time).total_seconds() < 5:
+        # Skip processing if too soon
+        return {
+            "success": True, 
+            "user": {
+                "id": best_match_id, 
+                "name": best_match_name, 
+                "time": current_time.isoformat(), 
+                "status": "Cooldown" 
+            },
+            "is_live": True
+        }
+    
+    last_processed_cache[best_match_id] = current_time
+
+    # Check recent attendance for this user (Lookback 20 hours to cover night shifts/timezone diffs)
+    lookback_time = (datetime.now(timezone.utc) - timedelta(hours=ATTENDANCE_LOOKBACK_HOURS)).isoformat()
+    
+    try:
+        if attendance_state.ready:
+            # Latest log from memory (see attendance_state.py)
+            logs = attendance_state.recent_logs(best_match_id)
+        else:
             # Fetch logs for the last 20 hours
             response = supabase.table('attendance_logs')\
                 .select("*")\
@@ -1129,158 +1531,157 @@ def process_image_for_recognition(image, sid=None):
                 .gte('timestamp', lookback_time)\
                 .order('timestamp', desc=True)\
                 .execute()
-            
+
             logs = response.data
+        
+        # Determine current state based on LATEST log
+        # If latest log is 'Masuk' or 'Terlambat', then we are currently checked in.
+        # If latest log is 'Pulang' or empty, we are checked out.
+        
+        if logs:
+            latest_status = logs[0]['status']
+            has_check_in = latest_status in ['Masuk', 'Terlambat']
+            has_check_out = latest_status == 'Pulang' # Or arguably, if latest is Pulang, has_check_in is False for *new* session
+        else:
+            has_check_in = False
+            has_check_out = False
             
-            # Determine current state based on LATEST log
-            # If latest log is 'Masuk' or 'Terlambat', then we are currently checked in.
-            # If latest log is 'Pulang' or empty, we are checked out.
-            
-            if logs:
-                latest_status = logs[0]['status']
-                has_check_in = latest_status in ['Masuk', 'Terlambat']
-                has_check_out = latest_status == 'Pulang' # Or arguably, if latest is Pulang, has_check_in is False for *new* session
-            else:
-                has_check_in = False
-                has_check_out = False
-                
-            # Refined Logic:
-            # If last log was "Masuk/Terlambat", we are IN -> Next action: Pulang
-            # If last log was "Pulang", we are OUT -> Next action: Masuk
+        # Refined Logic:
+        # If last log was "Masuk/Terlambat", we are IN -> Next action: Pulang
+        # If last log was "Pulang", we are OUT -> Next action: Masuk
+        
+        status = "Masuk" # Default intention
+        should_insert = False
+        
+        schedule = get_current_schedule()
+        
+        # Employee specific shift (moved up to be available for both IN/OUT and logging)
+        emp_shift = config_cache.employee_shift(best_match_id)
+        
+        current_shift_id = emp_shift.get('id') if emp_shift else None
+        current_schedule = emp_shift if emp_shift else schedule
+
+        st_hour, st_minute = current_schedule['start_hm']
+        schedule_start = current_time.replace(hour=st_hour, minute=st_minute, second=0, microsecond=0)
+
+        if not has_check_in:
+            # Rule 1: Check-in (First time only)
+            should_insert = True
             
-            status = "Masuk" # Default intention
-            should_insert = False
+            tolerance = current_schedule['tolerance_minutes']
+            late_threshold = schedule_start + timedelta(minutes=tolerance)
             
-            schedule = get_current_schedule()
+            if current_time.replace(tzinfo=None) > late_threshold.replace(tzinfo=None):
+                status = "Terlambat"
+            else:
+                status = "Masuk"
+        
+        elif has_check_in and not has_check_out:
+            # Rule 2: Check-out (Only after end_time)
+            # Use current_schedule (which respects employee shift) instead of global schedule
+            et_hour, et_minute = current_schedule['end_hm']
             
-            # Fetch employee specific shift (moved up to be available for both IN/OUT and logging)
-            emp_shift_res = supabase.table('employees').select('shifts(*)').eq('id', best_match_id).single().execute()
-            emp_shift = emp_shift_res.data.get('shifts') if emp_shift_res.data else None
+            schedule_end = current_time.replace(hour=et_hour, minute=et_minute, second=0, microsecond=0)
             
-            current_shift_id = emp_shift.get('id') if emp_shift else None
-            current_schedule = emp_shift if emp_shift else schedule
-
-            if not has_check_in:
-                # Rule 1: Check-in (First time only)
+            if current_time.replace(tzinfo=None) >= schedule_end.replace(tzinfo=None):
+                status = "Pulang"
                 should_insert = True
-                
-                start_time_str = current_schedule.get('start_time', '08:00')
-                tolerance = current_schedule.get('late_tolerance_minutes', 15)
-                
-                time_parts = list(map(int, start_time_str.split(':')))
-                st_hour = time_parts[0]
-                st_minute = time_parts[1]
-                
-                schedule_start = current_time.replace(hour=st_hour, minute=st_minute, second=0, microsecond=0)
-                late_threshold = schedule_start + timedelta(minutes=tolerance)
-                
-                if current_time.replace(tzinfo=None) > late_threshold.replace(tzinfo=None):
-                    status = "Terlambat"
-                else:
-                    status = "Masuk"
-            
-            elif has_check_in and not has_check_out:
-                # Rule 2: Check-out (Only after end_time)
-                # Use current_schedule (which respects employee shift) instead of global schedule
-                end_time_str = current_schedule.get('end_time', '17:00')
-                
-                # Parse end time
-                et_parts = list(map(int, end_time_str.split(':')))
-                et_hour = et_parts[0]
-                et_minute = et_parts[1]
-                
-                schedule_end = current_time.replace(hour=et_hour, minute=et_minute, second=0, microsecond=0)
-                
-                if current_time.replace(tzinfo=None) >= schedule_end.replace(tzinfo=None):
-                    status = "Pulang"
-                    should_insert = True
+            else:
+                # Early Departure Logic
+                # CHECK 1: Prevent "Pulang" if before Shift Start (e.g. scanned Masuk early, then scanned again)
+                schedule_start_dt = schedule_start.replace(tzinfo=None)
+                if current_time.replace(tzinfo=None) < schedule_start_dt:
+                    status = "Sudah Presensi Masuk"
+                    should_insert = False
                 else:
-                    # Early Departure Logic
-                    # CHECK 1: Prevent "Pulang" if before Shift Start (e.g. scanned Masuk early, then scanned again)
-                    schedule_start_dt = schedule_start.replace(tzinfo=None)
-                    if current_time.replace(tzinfo=None) < schedule_start_dt:
-                        status = "Sudah Presensi Masuk"
-                        should_insert = False
+                    # CHECK 2: Prevent Accidental Double Scan (Minimum 10 mins shift duration)
+                    # Ensure we don't checkout immediately after checkin
+                    last_in_time_str = logs[0]['timestamp'] if logs else None
+                    
+                    can_checkout = True
+                    if last_in_time_str:
+                         # Aware UTC (naive legacy rows are read as UTC)
+                         last_in = parse_timestamp(last_in_time_str)
+                         # Compare using UTC
+                         if (datetime.now(timezone.utc) - last_in).total_seconds() < 600: # 10 minutes
+                             can_checkout = False
+                    
+                    if can_checkout:
+                        status = "Pulang" # Allow early checkout if > 10 mins
+                        should_insert = True
                     else:
-                        # CHECK 2: Prevent Accidental Double Scan (Minimum 10 mins shift duration)
-                        # Ensure we don't checkout immediately after checkin
-                        last_in_time_str = logs[0]['timestamp'] if logs else None
-                        
-                        can_checkout = True
-                        if last_in_time_str:
-                             last_in = datetime.fromisoformat(last_in_time_str.replace("Z", "+00:00"))
-                             # Compare using UTC
-                             if (datetime.now(timezone.utc) - last_in).total_seconds() < 600: # 10 minutes
-                                 can_checkout = False
-                        
-                        if can_checkout:
-                            status = "Pulang" # Allow early checkout if > 10 mins
-                            should_insert = True
-                        else:
-                            status = "Sudah Presensi Masuk (Barusan)"
-                            should_insert = False
+                        status = "Sudah Presensi Masuk (Barusan)"
+                        should_insert = False
 
-            
+        
+        else:
+            # Already checked in and checked out
+            status = "Sudah Pulang"
+            should_insert = False
+
+        # Use UTC for Database Storage (and the in-memory state, which
+        # compares it against aware datetimes)
+        utc_now = current_time.astimezone(timezone.utc).isoformat()
+
+        if should_insert:
+            log_entry = {
+                "employee_id": best_match_id,
+                "timestamp": utc_now,
+                "status": status,
+                "shift_id": current_shift_id,
+                "confidence_score": 1.0 - min_distance # roughly
+            }
+            if attendance_spool is not None:
+                # Durable local spool, flushed to Supabase in the background
+                attendance_spool.enqueue(log_entry)
             else:
-                # Already checked in and checked out
-                status = "Sudah Pulang"
-                should_insert = False
-
-            # Use UTC for Database Storage
-            utc_now = datetime.now(timezone.utc).isoformat()
-
-            if should_insert:
-                log_entry = {
-                    "employee_id": best_match_id,
-                    "timestamp": current_time.isoformat(),
-                    "status": status,
-                    "shift_id": current_shift_id,
-                    "confidence_score": 1.0 - min_distance # roughly
-                }
                 supabase.table('attendance_logs').insert(log_entry).execute()
-                
-                # --- Notification ---
-                phone_number = known_faces_cache.get(best_match_id, {}).get('phone_number')
-                print(f"[DEBUG] Notification: User={best_match_name}, Phone={phone_number}")
-                
-                if phone_number:
-                    notification_service.notify_employee_checkin(best_match_name, current_time.strftime("%H:%M"), status, phone_number)
-                else:
-                    print(f"[DEBUG] No phone number for {best_match_name}, skipping notification.")
-                
-                # Alert Admin if very late (e.g. > 30 mins)
-                if status == "Terlambat":
-                     # Calculate lateness
-                     # Simple logic: if tolerance is 15, and they are marked late, they are late.
-                     # Check actual minutes late if needed, but for now just alert.
-                     # notification_service.notify_admin_late_checkin(best_match_name, "XX") # Placeholder duration
-                     pass # Placeholder for notification_service call
-                
-        except Exception as e:
-            print(f"Error logging attendance: {e}")
-            status = "Error"
-
-        return {
-            "success": True,
-            "user": {
-                "id": best_match_id,
-                "name": best_match_name,
-                "time": current_time.isoformat(),
-                "status": status
-            },
-            "is_live": True
-        }
-    else:
-         return {"success": False, "error": "Unknown face", "is_live": True}
-
-def base64_to_image(base64_string):
+            attendance_state.record(best_match_id, status, log_entry["timestamp"], current_shift_id)
+            
+            # --- Notification ---
+            phone_number = known_faces_cache.get(best_match_id, {}).get('phone_number')
+            print(f"[DEBUG] Notification: User={best_match_name}, Phone={phone_number}")
+            
+            if phone_number:
+                notification_service.notify_employee_checkin(best_match_name, current_time.strftime("%H:%M"), status, phone_number)
+            else:
+                print(f"[DEBUG] No phone number for {best_match_name}, skipping notification.")
+            
+            # Alert Admin if very late (e.g. > 30 mins)
+            if status == "Terlambat":
+                 # Minutes after shift start; batched into one admin digest per window
+                 minutes_late = int((current_time.replace(tzinfo=None) - schedule_start.replace(tzinfo=None)).total_seconds() // 60)
+                 notification_service.notify_admin_late_checkin(best_match_name, minutes_late)
+            
+    except Exception as e:
+        print(f"Error logging attendance: {e}")
+        status = "Error"
+
+    return {
+        "success": True,
+        "user": {
+            "id": best_match_id,
+            "name": best_match_name,
+            "time": current_time.isoformat(),
+            "status": status
+        },
+        "is_live": True
+    }
+
+def base64_to_bytes(base64_string):
     if "base64," in base64_string:
         base64_string = base64_string.split("base64,")[1]
-    
-    image_bytes = base64.b64decode(base64_string)
-    np_arr = np.frombuffer(image_bytes, np.uint8)
-    image = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return base64.b64decode(base64_string)
+
+def base64_to_image(base64_string):
+    return decode_image(base64_to_bytes(base64_string))
+
+def frame_bytes(image_data):
+    # process_frame payloads are either base64 data URLs (legacy clients) or
+    # binary frames, which arrive as bytes and are used as-is
+    if isinstance(image_data, str):
+        return base64_to_bytes(image_data)
+    return image_data
 
 # --- WebSocket Events ---
 
@@ -1288,28 +1689,81 @@ def base64_to_image(base64_string):
 def handle_connect():
     sid = request.sid
     print(f'Client connected: {sid}')
-    # Initialize state
-    client_states[sid] = ClientState()
+    # Liveness state is created on the first process_frame, so sockets that
+    # never send frames (dashboards, reconnects) cost nothing
 
 @socketio.on('disconnect')
 def handle_disconnect():
     sid = request.sid
     print(f'Client disconnected: {sid}')
-    # Clean up
-    if sid in client_states:
-        del client_states[sid]
+    active_sessions.pop(sid)
+    close_session(sid)
+
+def close_session(sid):
+    # A drain loop still processing a frame of this sid could write its
+    # state back after a release, so it releases the session itself when done
+    if frame_buffer.close(sid):
+        release_session(sid)
+
+def release_session(sid):
+    # Clean up everything held for a socket session
+    client_states.pop(sid, None)
+    if recognition_executor is not None:
+        recognition_executor.drop_session(sid)
+    frame_buffer.drop_session(sid)
+    face_trackers.pop(sid, None)
 
 @socketio.on('process_frame')
 def handle_process_frame(data):
+    # Only buffer the frame here; a single drain loop per session processes
+    # the newest one, so a slow server drops stale frames instead of queueing
+    sid = request.sid
     try:
-        sid = request.sid
-        image = base64_to_image(data.get('image', ''))
-        # Pass SID to use process-state
-        result = process_image_for_recognition(image, sid=sid)
-        emit('attendance_result', result)
+        if isinstance(data, (bytes, bytearray)):
+            # Bare binary frame: the sequence number (if any) is in its header
+            header = frame_header(data)
+            seq, image_data = (header[3] if header else None), data
+        else:
+            seq, image_data = data.get('seq'), data.get('image', '')
     except Exception as e:
         print(f"Socket processing error: {e}")
-        emit('attendance_result', {"success": False, "error": "Processing error"})
+        socketio.emit('attendance_result', {"success": False, "error": "Processing error"}, to=sid)
+        return
+    active_sessions[sid] = time.time()
+    if frame_buffer.offer(sid, seq, image_data):
+        socketio.start_background_task(drain_frames, sid)
+
+def drain_frames(sid):
+    while True:
+        item = frame_buffer.take(sid)
+        if item is CLOSED:
+            release_session(sid)
+            return
+        if item is None:
+            return
+        seq, image_data = item
+        try:
+            result = recognize_frame(sid, image_data)
+        except Exception as e:
+            print(f"Socket processing error: {e}")
+            result = {"success": False, "error": "Processing error"}
+        result["seq"] = seq
+        socketio.emit('attendance_result', result, to=sid)
+
+def recognize_frame(sid, image_data):
+    if recognition_executor is not None:
+        # Decode, liveness and encoding run in the worker pinned to this sid
+        tracker = get_tracker(sid)
+        encoding, failure, location = recognition_executor.analyze(
+            sid, frame_bytes(image_data),
+            track_box=tracker.hint() if tracker else None, track_iou=TRACK_IOU_THRESHOLD
+        )
+        return finish_recognition(encoding, failure, location, tracker)
+    image, full_frame, scale = decode_frame_reduced(frame_bytes(image_data), FRAME_DECODE_SCALE)
+    if image is None:
+        return {"success": False, "error": "Processing error"}
+    # Pass SID to use process-state
+    return process_image_for_recognition(image, sid=sid, full_frame=full_frame, scale=scale)
 
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', 5001))
@@ -0,0 +1,11 @@
+-- Run this in your Supabase SQL Editor
+-- Idempotency key for write-behind attendance inserts (see attendance_spool.py).
+-- A retried batch upserts ON CONFLICT (idempotency_key) DO NOTHING, so a log that
+-- already reached the table is not inserted twice. Older rows keep NULL.
+
+ALTER TABLE attendance_logs
+ADD COLUMN IF NOT EXISTS idempotency_key TEXT;
+
+ALTER TABLE attendance_logs
+ADD CONSTRAINT attendance_logs_idempotency_key_key UNIQUE (idempotency_key);
+
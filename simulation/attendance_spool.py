@@ -0,0 +1,237 @@
+import json
+import sqlite3
+import threading
+import time
+import uuid
+
+
+def is_rejected(exc):
+    """
+    True when the database refused the rows themselves (constraint or data
+    errors), so sending them again cannot succeed. Transport errors, 5xx and
+    anything unrecognised count as transient.
+    """
+    # PostgREST APIError carries the Postgres SQLSTATE: 22xxx data exception,
+    # 23xxx integrity violation (foreign key, not null, check, ...)
+    code = getattr(exc, "code", None)
+    if isinstance(code, str) and code[:2] in ("22", "23"):
+        return True
+    # SQLite data store (data_store.py) re-raises the sqlite3 error as the cause
+    return isinstance(exc.__cause__, (sqlite3.IntegrityError, sqlite3.DataError))
+
+
+class AttendanceSpool:
+    """
+    Write-behind queue for attendance_logs inserts.
+
+    enqueue() stores the log in a local SQLite database (WAL mode, so it
+    survives crashes and restarts) and returns immediately. A background
+    flusher sends spooled rows to Supabase as multi-row upserts, oldest
+    first, and deletes them locally only after the database accepted them.
+    Failures are retried with exponential backoff.
+
+    Every row carries an `idempotency_key` (unique in attendance_logs, see
+    attendance_idempotency_migration.sql), so a batch that reached Supabase
+    but whose response was lost is not inserted twice when retried. Without
+    the migration the flusher falls back to plain inserts.
+
+    Only transient failures are retried. When the database rejects a batch
+    (e.g. a foreign key violation after the employee was deleted), the batch
+    is bisected until the offending rows are isolated; those move to the
+    dead_letter table and the rest is flushed, so one bad row cannot hold
+    back every later check-in.
+    """
+
+    def __init__(self, supabase, path, batch_size=200, interval=1.0, max_backoff=60.0):
+        self.supabase = supabase
+        self.path = path
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.idempotent = True
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS spool ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " idempotency_key TEXT NOT NULL UNIQUE,"
+            " payload TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS dead_letter ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " idempotency_key TEXT NOT NULL,"
+            " payload TEXT NOT NULL,"
+            " error TEXT,"
+            " created_at REAL NOT NULL,"
+            " failed_at REAL NOT NULL)"
+        )
+        self.enqueued = 0
+        self.flushed = 0
+        self.batches = 0
+        self.failures = 0
+        self.rejected = 0
+        self.last_error = None
+        self.last_flush = None
+
+    def enqueue(self, log_entry):
+        """
+        Durably queue one attendance_logs row. Returns its idempotency key.
+        """
+        key = log_entry.get("idempotency_key") or str(uuid.uuid4())
+        payload = json.dumps({**log_entry, "idempotency_key": key}, default=float)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR IGNORE INTO spool (idempotency_key, payload, created_at) VALUES (?, ?, ?)",
+                (key, payload, time.time())
+            )
+            self.enqueued += 1
+        self._wake.set()
+        return key
+
+    def _pending(self):
+        with self._lock:
+            return self._db.execute(
+                "SELECT id, payload FROM spool ORDER BY id LIMIT ?", (self.batch_size,)
+            ).fetchall()
+
+    def pending_logs(self):
+        """
+        Every attendance_logs row still waiting in the spool, oldest first.
+        """
+        with self._lock:
+            rows = self._db.execute("SELECT payload FROM spool ORDER BY id").fetchall()
+        return [json.loads(payload) for payload, in rows]
+
+    def _delete(self, ids):
+        placeholders = ",".join("?" * len(ids))
+        with self._lock:
+            self._db.execute(f"DELETE FROM spool WHERE id IN ({placeholders})", ids)
+            self.flushed += len(ids)
+
+    def _dead_letter(self, row_id, error):
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO dead_letter (idempotency_key, payload, error, created_at, failed_at)"
+                " SELECT idempotency_key, payload, ?, created_at, ? FROM spool WHERE id = ?",
+                (error, time.time(), row_id)
+            )
+            self._db.execute("DELETE FROM spool WHERE id = ?", (row_id,))
+            self.rejected += 1
+        print(f"Attendance spool: log {row_id} rejected, moved to dead_letter: {error}")
+
+    def _isolate(self, pending, error):
+        """
+        Bisect a rejected batch: flush the halves that are accepted and
+        dead-letter single rows that are rejected. Transient errors propagate
+        (rows already handled stay handled).
+        """
+        if len(pending) == 1:
+            self._dead_letter(pending[0][0], str(error))
+            return
+        mid = len(pending) // 2
+        for half in (pending[:mid], pending[mid:]):
+            try:
+                self._send([json.loads(payload) for _, payload in half])
+            except Exception as e:
+                if not is_rejected(e):
+                    raise
+                self._isolate(half, e)
+                continue
+            self._delete([row_id for row_id, _ in half])
+
+    def _send(self, rows):
+        table = self.supabase.table('attendance_logs')
+        if self.idempotent:
+            try:
+                table.upsert(rows, on_conflict='idempotency_key', ignore_duplicates=True).execute()
+                return
+            except Exception as e:
+                if 'idempotency_key' not in str(e):
+                    raise
+                print("Attendance spool: idempotency_key column missing, falling back to plain inserts")
+                self.idempotent = False
+        table.insert([{k: v for k, v in row.items() if k != 'idempotency_key'} for row in rows]).execute()
+
+    def flush_once(self):
+        """
+        Send one batch. Returns the number of rows flushed (0 when empty).
+        Raises if Supabase rejected the batch.
+        """
+        pending = self._pending()
+        if not pending:
+            return 0
+        ids = [row_id for row_id, _ in pending]
+        placeholders = ",".join("?" * len(ids))
+        try:
+            try:
+                self._send([json.loads(payload) for _, payload in pending])
+            except Exception as e:
+                if not is_rejected(e):
+                    raise
+                self._isolate(pending, e)
+            else:
+                self._delete(ids)
+        except Exception:
+            with self._lock:
+                self._db.execute(f"UPDATE spool SET attempts = attempts + 1 WHERE id IN ({placeholders})", ids)
+            raise
+        with self._lock:
+            self.batches += 1
+            self.last_flush = time.time()
+        return len(ids)
+
+    def flush(self):
+        """
+        Flush until the spool is empty or a batch fails.
+        """
+        while self.flush_once() >= self.batch_size:
+            pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            backoff = self.interval
+            while True:
+                self._wake.wait(backoff)
+                self._wake.clear()
+                try:
+                    self.flush()
+                    backoff = self.interval
+                except Exception as e:
+                    self.failures += 1
+                    self.last_error = str(e)
+                    backoff = min(self.max_backoff, max(self.interval, backoff * 2))
+                    print(f"Attendance spool flush failed (retry in {backoff:.0f}s): {e}")
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            depth, oldest, max_attempts = self._db.execute(
+                "SELECT COUNT(*), MIN(created_at), MAX(attempts) FROM spool"
+            ).fetchone()
+            dead_letter = self._db.execute("SELECT COUNT(*) FROM dead_letter").fetchone()[0]
+            return {
+                "depth": depth,
+                "lag_seconds": round(time.time() - oldest, 2) if oldest else 0.0,
+                "max_attempts": max_attempts or 0,
+                "enqueued": self.enqueued,
+                "flushed": self.flushed,
+                "batches": self.batches,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "dead_letter": dead_letter,
+                "last_error": self.last_error,
+                "last_flush": self.last_flush,
+                "idempotent": self.idempotent
+            }
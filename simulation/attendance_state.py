@@ -0,0 +1,162 @@
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+
+def parse_timestamp(value):
+    """
+    attendance_logs timestamp (ISO string) to an aware datetime. Naive values
+    are read as UTC, which is how the timestamptz column stores them.
+    """
+    ts = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    return ts
+
+
+class AttendanceStateStore:
+    """
+    Latest attendance log per employee, kept in memory so recognition does
+    not query attendance_logs for every match.
+
+    warm() loads the last `lookback_hours` of logs in one paged bulk query.
+    Every insert done by this process must be reported with record(). The
+    store is re-read from the database every `reconcile_interval` seconds
+    to pick up rows written elsewhere (other instances, SQL edits, resets);
+    entries recorded while a reconcile is running are kept.
+
+    `pending` (optional) returns the logs recorded but not yet in the
+    database (the write-behind spool). They are laid over every reload, so
+    a restart or outage with unflushed check-ins does not fall back to an
+    older log and record a second check-in.
+    """
+
+    def __init__(self, supabase, lookback_hours=20, reconcile_interval=300.0, page_size=1000, pending=None):
+        self.supabase = supabase
+        self.pending = pending
+        self.lookback = timedelta(hours=lookback_hours)
+        self.reconcile_interval = reconcile_interval
+        self.page_size = page_size
+        self._lock = threading.Lock()
+        self._latest = {}        # employee_id -> {"status", "timestamp", "shift_id", "at"}
+        self._touched = set()    # employee ids recorded since the running reconcile started
+        self._thread = None
+        self.ready = False
+        self.last_reconcile = None
+        self.reconciles = 0
+        self.corrections = 0
+
+    def _fetch(self):
+        since = (datetime.now(timezone.utc) - self.lookback).isoformat()
+        latest = {}
+        offset = 0
+        while True:
+            res = self.supabase.table('attendance_logs')\
+                .select("employee_id, status, timestamp, shift_id")\
+                .gte('timestamp', since)\
+                .order('timestamp')\
+                .range(offset, offset + self.page_size - 1)\
+                .execute()
+            rows = res.data or []
+            for row in rows:
+                # Ascending order: the last row seen per employee is the latest
+                latest[row['employee_id']] = {
+                    "status": row['status'],
+                    "timestamp": row['timestamp'],
+                    "shift_id": row.get('shift_id'),
+                    "at": parse_timestamp(row['timestamp'])
+                }
+            if len(rows) < self.page_size:
+                return latest
+            offset += self.page_size
+
+    def warm(self):
+        with self._lock:
+            self._touched = set()
+        # Read the spool first: rows flushed meanwhile are in the fetch, rows
+        # spooled meanwhile were record()ed and are kept as touched
+        pending = self.pending() if self.pending is not None else []
+        latest = self._fetch()
+        for row in pending:
+            at = parse_timestamp(row['timestamp'])
+            current = latest.get(row['employee_id'])
+            if current is None or current["at"] <= at:
+                latest[row['employee_id']] = {
+                    "status": row['status'],
+                    "timestamp": row['timestamp'],
+                    "shift_id": row.get('shift_id'),
+                    "at": at
+                }
+        with self._lock:
+            for emp_id in self._touched:
+                if emp_id in self._latest:
+                    latest[emp_id] = self._latest[emp_id]
+            if self.ready:
+                self.corrections += sum(
+                    1 for emp_id in set(latest) | set(self._latest)
+                    if (latest.get(emp_id) or {}).get("timestamp") != (self._latest.get(emp_id) or {}).get("timestamp")
+                )
+            self._latest = latest
+            self._touched = set()
+            self.ready = True
+            self.last_reconcile = time.time()
+            self.reconciles += 1
+
+    def recent_logs(self, employee_id):
+        """
+        Same shape as the old lookback query: [] or [latest log] within the
+        lookback window, newest first.
+        """
+        with self._lock:
+            entry = self._latest.get(employee_id)
+        if entry is None or entry["at"] < datetime.now(timezone.utc) - self.lookback:
+            return []
+        return [{"status": entry["status"], "timestamp": entry["timestamp"], "shift_id": entry["shift_id"]}]
+
+    def record(self, employee_id, status, timestamp, shift_id=None):
+        """
+        Report an inserted attendance log. Older timestamps than the current
+        entry (e.g. back-dated manual entries) do not replace it.
+        """
+        at = parse_timestamp(timestamp)
+        with self._lock:
+            self._touched.add(employee_id)
+            current = self._latest.get(employee_id)
+            if current is not None and current["at"] > at:
+                return
+            self._latest[employee_id] = {"status": status, "timestamp": timestamp, "shift_id": shift_id, "at": at}
+
+    def forget(self, employee_id=None):
+        """
+        Drop one employee (or everyone) after their logs were deleted.
+        """
+        with self._lock:
+            if employee_id is None:
+                self._latest.clear()
+            else:
+                self._latest.pop(employee_id, None)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.reconcile_interval)
+                try:
+                    self.warm()
+                except Exception as e:
+                    print(f"Attendance state reconcile error: {e}")
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "employees": len(self._latest),
+                "reconciles": self.reconciles,
+                "corrections": self.corrections,
+                "last_reconcile": self.last_reconcile
+            }
@@ -0,0 +1,110 @@
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+
+
+class AuditSink:
+    """
+    Buffered writer for audit_logs.
+
+    log() only appends to an in-memory buffer, so admin endpoints do not wait
+    for Supabase. A background thread writes the buffer as one bulk insert
+    when `batch_size` entries are waiting or `interval` seconds passed, and
+    flush() is called once more at shutdown.
+
+    Entries get their id and created_at when logged, so the table keeps the
+    real action time and a retried batch is upserted on id without
+    duplicates. A failed batch stays buffered for the next flush; beyond
+    `max_buffer` entries the oldest are dropped (and counted).
+    """
+
+    def __init__(self, supabase, batch_size=50, interval=2.0, max_buffer=5000):
+        self.supabase = supabase
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_buffer = max_buffer
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._buffer = deque()
+        self._thread = None
+        self.logged = 0
+        self.written = 0
+        self.failed = 0
+        self.dropped = 0
+        self.last_error = None
+
+    def log(self, actor_name, action, target_id=None, details=None):
+        entry = {
+            "id": str(uuid.uuid4()),
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "actor_name": actor_name,
+            "action": action,
+            "target_id": None if target_id is None else str(target_id),
+            "details": details or {}
+        }
+        with self._lock:
+            self._buffer.append(entry)
+            self.logged += 1
+            while len(self._buffer) > self.max_buffer:
+                self._buffer.popleft()
+                self.dropped += 1
+            full = len(self._buffer) >= self.batch_size
+        if full:
+            self._wake.set()
+        return entry
+
+    def flush(self):
+        """
+        Write everything buffered. Returns the number of entries written;
+        on failure the batch is put back and the error re-raised.
+        """
+        written = 0
+        with self._flush_lock:
+            while True:
+                with self._lock:
+                    batch = [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+                if not batch:
+                    return written
+                try:
+                    self.supabase.table('audit_logs').upsert(batch, on_conflict='id', ignore_duplicates=True).execute()
+                except Exception as e:
+                    with self._lock:
+                        self.failed += 1
+                        self.last_error = str(e)
+                        self._buffer.extendleft(reversed(batch))
+                        while len(self._buffer) > self.max_buffer:
+                            self._buffer.popleft()
+                            self.dropped += 1
+                    raise
+                written += len(batch)
+                with self._lock:
+                    self.written += len(batch)
+
+    def start(self):
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                self._wake.wait(self.interval)
+                self._wake.clear()
+                try:
+                    self.flush()
+                except Exception as e:
+                    print(f"Failed to write audit logs (will retry): {e}")
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "pending": len(self._buffer),
+                "logged": self.logged,
+                "written": self.written,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "last_error": self.last_error
+            }
@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the per-frame liveness math: the previous path (list of
+all 478 landmark tuples + six scipy euclidean calls) against the vectorized
+one in frame_pipeline (12 eye landmarks, both EARs in one NumPy expression).
+
+Uses synthetic FaceMesh-shaped landmarks, so no camera or model is needed.
+
+Usage:
+  python bench_liveness.py
+  python bench_liveness.py --runs 20000
+"""
+import math
+import random
+import argparse
+import timeit
+from types import SimpleNamespace
+
+from frame_pipeline import LEFT_EYE, RIGHT_EYE, eye_points, calculate_ear
+
+try:
+    from scipy.spatial import distance as dist
+    euclidean = dist.euclidean
+except ImportError:
+    # scipy is no longer a dependency; math.dist understates the old cost
+    print("Note: scipy not installed, the previous path uses math.dist")
+    euclidean = math.dist
+
+FACEMESH_LANDMARKS = 478
+WIDTH, HEIGHT = 640, 480
+
+
+def synthetic_face(seed=0):
+    rng = random.Random(seed)
+    return SimpleNamespace(landmark=[
+        SimpleNamespace(x=rng.random(), y=rng.random(), z=0.0)
+        for _ in range(FACEMESH_LANDMARKS)
+    ])
+
+
+def previous_ear(face_landmarks, w, h):
+    landmarks = [(lm.x * w, lm.y * h) for lm in face_landmarks.landmark]
+
+    def ear(indices):
+        A = euclidean(landmarks[indices[1]], landmarks[indices[5]])
+        B = euclidean(landmarks[indices[2]], landmarks[indices[4]])
+        C = euclidean(landmarks[indices[0]], landmarks[indices[3]])
+        return (A + B) / (2.0 * C)
+
+    return (ear(LEFT_EYE) + ear(RIGHT_EYE)) / 2.0
+
+
+def vectorized_ear(face_landmarks, w, h):
+    leftEAR, rightEAR = calculate_ear(eye_points(face_landmarks, w, h))
+    return (leftEAR + rightEAR) / 2.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the liveness EAR computation")
+    parser.add_argument("--runs", type=int, default=10000)
+    args = parser.parse_args()
+
+    faces = [synthetic_face(seed) for seed in range(16)]
+    for face in faces:
+        old, new = previous_ear(face, WIDTH, HEIGHT), vectorized_ear(face, WIDTH, HEIGHT)
+        if not math.isclose(old, new, rel_tol=1e-9):
+            raise SystemExit(f"EAR mismatch: previous {old} vs vectorized {new}")
+
+    results = {}
+    for name, fn in (("previous", previous_ear), ("vectorized", vectorized_ear)):
+        seconds = timeit.timeit(
+            lambda: [fn(face, WIDTH, HEIGHT) for face in faces],
+            number=max(1, args.runs // len(faces))
+        )
+        results[name] = seconds * 1e6 / args.runs
+        print(f"{name:>10}: {results[name]:8.2f} us/frame")
+    print(f"   speedup: {results['previous'] / results['vectorized']:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+from ttl_store import TTLStore
+
+DEFAULT_SCHEDULE = {"start_time": "08:00", "end_time": "17:00", "late_tolerance_minutes": 15}
+
+
+def parse_hm(value, default):
+    # "HH:MM" or "HH:MM:SS" -> (hour, minute)
+    parts = (value or default).split(':')
+    return int(parts[0]), int(parts[1])
+
+
+def with_times(row):
+    """
+    Copy of a settings / shift row with its times parsed once:
+    start_hm, end_hm as (hour, minute) and tolerance_minutes.
+    """
+    schedule = dict(row)
+    schedule["start_hm"] = parse_hm(row.get("start_time"), DEFAULT_SCHEDULE["start_time"])
+    schedule["end_hm"] = parse_hm(row.get("end_time"), DEFAULT_SCHEDULE["end_time"])
+    tolerance = row.get("late_tolerance_minutes")
+    schedule["tolerance_minutes"] = int(tolerance if tolerance is not None else DEFAULT_SCHEDULE["late_tolerance_minutes"])
+    return schedule
+
+
+class ConfigCache:
+    """
+    Cached attendance configuration: global settings, all shifts and the
+    shift assigned to each employee.
+
+    Entries expire after `ttl` seconds, and the endpoints that change them
+    call the matching invalidate_*() right after their write, so a change
+    made through this server is visible on the next scan. Changes made
+    elsewhere show up within `ttl`.
+    """
+
+    def __init__(self, supabase, ttl=300.0, max_employees=20000):
+        self.supabase = supabase
+        self._config = TTLStore(ttl, name="config")                  # "settings" / "shifts"
+        self._employees = TTLStore(ttl, max_size=max_employees, name="employee_shift")
+        self.hits = 0
+        self.misses = 0
+
+    def schedule(self):
+        """
+        Global attendance settings (id=1) with parsed times, or the defaults.
+        """
+        schedule = self._config.get("settings")
+        if schedule is not None:
+            self.hits += 1
+            return schedule
+        self.misses += 1
+        try:
+            response = self.supabase.table('attendance_settings').select("*").eq('id', 1).execute()
+            row = response.data[0] if response.data else DEFAULT_SCHEDULE
+        except Exception:
+            # Table missing: defaults, but retry on the next scan
+            return with_times(DEFAULT_SCHEDULE)
+        schedule = with_times(row)
+        self._config["settings"] = schedule
+        return schedule
+
+    def shifts(self):
+        """
+        { shift_id: shift row with parsed times }
+        """
+        shifts = self._config.get("shifts")
+        if shifts is not None:
+            return shifts
+        res = self.supabase.table('shifts').select("*").execute()
+        shifts = {row['id']: with_times(row) for row in res.data}
+        self._config["shifts"] = shifts
+        return shifts
+
+    def employee_shift(self, employee_id):
+        """
+        Shift row (parsed times) assigned to an employee, or None.
+        """
+        shift_id = self._employees.get(employee_id, _MISSING)
+        if shift_id is _MISSING:
+            self.misses += 1
+            res = self.supabase.table('employees').select('shift_id').eq('id', employee_id).execute()
+            shift_id = res.data[0].get('shift_id') if res.data else None
+            self._employees[employee_id] = shift_id
+        else:
+            self.hits += 1
+        if shift_id is None:
+            return None
+        return self.shifts().get(shift_id)
+
+    def invalidate_settings(self):
+        self._config.pop("settings")
+
+    def invalidate_shifts(self):
+        self._config.pop("shifts")
+
+    def invalidate_employee(self, employee_id):
+        self._employees.pop(employee_id)
+
+    def sweep(self):
+        return self._config.sweep() + self._employees.sweep()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "employees": self._employees.stats()
+        }
+
+
+_MISSING = object()
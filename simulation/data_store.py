@@ -0,0 +1,454 @@
+import json
+import os
+import sqlite3
+import threading
+import uuid
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    email TEXT NOT NULL UNIQUE,
+    password TEXT NOT NULL,
+    name TEXT,
+    role TEXT DEFAULT 'admin',
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS departments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS positions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    title TEXT NOT NULL,
+    department_id INTEGER REFERENCES departments(id) ON DELETE SET NULL,
+    level INTEGER DEFAULT 1,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS shifts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    start_time TEXT,
+    end_time TEXT,
+    late_tolerance_minutes INTEGER DEFAULT 15,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS employees (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    phone_number TEXT,
+    face_encoding TEXT,
+    shift_id INTEGER REFERENCES shifts(id) ON DELETE SET NULL,
+    department_id INTEGER REFERENCES departments(id) ON DELETE SET NULL,
+    position_id INTEGER REFERENCES positions(id) ON DELETE SET NULL,
+    leave_quota INTEGER DEFAULT 12,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    updated_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS attendance_logs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    employee_id TEXT REFERENCES employees(id) ON DELETE CASCADE,
+    timestamp TEXT NOT NULL,
+    status TEXT,
+    shift_id INTEGER REFERENCES shifts(id) ON DELETE SET NULL,
+    confidence_score REAL,
+    idempotency_key TEXT UNIQUE,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE INDEX IF NOT EXISTS attendance_logs_employee_timestamp_idx ON attendance_logs (employee_id, timestamp);
+CREATE INDEX IF NOT EXISTS attendance_logs_timestamp_idx ON attendance_logs (timestamp);
+
+CREATE TABLE IF NOT EXISTS attendance_settings (
+    id INTEGER PRIMARY KEY,
+    start_time TEXT,
+    end_time TEXT,
+    late_tolerance_minutes INTEGER DEFAULT 15
+);
+
+CREATE TABLE IF NOT EXISTS leaves (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    employee_id TEXT REFERENCES employees(id) ON DELETE CASCADE,
+    type TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    reason TEXT,
+    status TEXT DEFAULT 'Pending',
+    approver_id TEXT REFERENCES employees(id),
+    rejection_reason TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE INDEX IF NOT EXISTS leaves_employee_idx ON leaves (employee_id);
+CREATE INDEX IF NOT EXISTS leaves_dates_idx ON leaves (start_date, end_date);
+
+CREATE TABLE IF NOT EXISTS holidays (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL UNIQUE,
+    description TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+
+CREATE TABLE IF NOT EXISTS audit_logs (
+    id TEXT PRIMARY KEY,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now')),
+    actor_name TEXT NOT NULL,
+    action TEXT NOT NULL,
+    target_id TEXT,
+    details TEXT
+);
+CREATE INDEX IF NOT EXISTS audit_logs_created_idx ON audit_logs (created_at);
+
+-- Change log for incremental gallery sync, as in gallery_sync_migration.sql
+CREATE TABLE IF NOT EXISTS employee_changes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    employee_id TEXT NOT NULL,
+    op TEXT NOT NULL,
+    changed_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%f+00:00', 'now'))
+);
+CREATE TRIGGER IF NOT EXISTS employees_change_insert AFTER INSERT ON employees
+BEGIN INSERT INTO employee_changes (employee_id, op) VALUES (NEW.id, 'upsert'); END;
+CREATE TRIGGER IF NOT EXISTS employees_change_update AFTER UPDATE ON employees
+BEGIN INSERT INTO employee_changes (employee_id, op) VALUES (NEW.id, 'upsert'); END;
+CREATE TRIGGER IF NOT EXISTS employees_change_delete AFTER DELETE ON employees
+BEGIN INSERT INTO employee_changes (employee_id, op) VALUES (OLD.id, 'delete'); END;
+"""
+
+# Columns stored as JSON text in SQLite (json / jsonb in Postgres)
+JSON_COLUMNS = {
+    "employees": {"face_encoding"},
+    "audit_logs": {"details"}
+}
+
+# Embeddable many-to-one relations: (table, relation) -> foreign key column
+RELATIONS = {
+    ("employees", "shifts"): "shift_id",
+    ("employees", "departments"): "department_id",
+    ("employees", "positions"): "position_id",
+    ("positions", "departments"): "department_id",
+    ("attendance_logs", "employees"): "employee_id",
+    ("attendance_logs", "shifts"): "shift_id",
+    ("leaves", "employees"): "employee_id"
+}
+
+# Tables whose text primary key is generated client-side when missing
+UUID_KEYS = {"audit_logs"}
+
+
+class DataStoreError(Exception):
+    pass
+
+
+class Response:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+
+def _split_columns(columns):
+    # "a, b(c, d), e" -> ["a", "b(c, d)", "e"]
+    parts, depth, current = [], 0, ""
+    for ch in columns:
+        if ch == "," and depth == 0:
+            parts.append(current.strip())
+            current = ""
+            continue
+        depth += ch == "("
+        depth -= ch == ")"
+        current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+class _Query:
+    def __init__(self, store, table):
+        self.store = store
+        self.table = table
+        self._op = "select"
+        self._columns = "*"
+        self._count = None
+        self._values = None
+        self._on_conflict = None
+        self._ignore_duplicates = False
+        self._where = []
+        self._params = []
+        self._order = []
+        self._limit = None
+        self._offset = None
+        self._single = False
+        self._negate = False
+
+    # --- Operations ---
+    def select(self, columns="*", count=None):
+        self._columns, self._count = columns, count
+        return self
+
+    def insert(self, rows):
+        self._op, self._values = "insert", rows
+        return self
+
+    def upsert(self, rows, on_conflict=None, ignore_duplicates=False):
+        self._op, self._values = "upsert", rows
+        self._on_conflict, self._ignore_duplicates = on_conflict, ignore_duplicates
+        return self
+
+    def update(self, values):
+        self._op, self._values = "update", values
+        return self
+
+    def delete(self):
+        self._op = "delete"
+        return self
+
+    # --- Filters ---
+    @property
+    def not_(self):
+        self._negate = True
+        return self
+
+    def _filter(self, sql, *params):
+        if self._negate:
+            sql = f"NOT ({sql})"
+            self._negate = False
+        self._where.append(sql)
+        self._params.extend(params)
+        return self
+
+    def eq(self, column, value):
+        return self._filter(f'"{column}" = ?', value)
+
+    def neq(self, column, value):
+        return self._filter(f'"{column}" != ?', value)
+
+    def gt(self, column, value):
+        return self._filter(f'"{column}" > ?', value)
+
+    def gte(self, column, value):
+        return self._filter(f'"{column}" >= ?', value)
+
+    def lt(self, column, value):
+        return self._filter(f'"{column}" < ?', value)
+
+    def lte(self, column, value):
+        return self._filter(f'"{column}" <= ?', value)
+
+    def in_(self, column, values):
+        values = list(values)
+        if not values:
+            return self._filter("0")
+        return self._filter(f'"{column}" IN ({",".join("?" * len(values))})', *values)
+
+    def is_(self, column, value):
+        if value in (None, "null"):
+            return self._filter(f'"{column}" IS NULL')
+        return self._filter(f'"{column}" IS ?', value)
+
+    # --- Modifiers ---
+    def order(self, column, desc=False):
+        self._order.append(f'"{column}" {"DESC" if desc else "ASC"}')
+        return self
+
+    def limit(self, n):
+        self._limit = int(n)
+        return self
+
+    def range(self, start, end):
+        self._offset, self._limit = int(start), int(end) - int(start) + 1
+        return self
+
+    def single(self):
+        self._single = True
+        return self
+
+    def execute(self):
+        return self.store._execute(self)
+
+
+class SQLiteStore:
+    """
+    Local SQLite backend with the Supabase client's interface.
+
+    table(name) returns a query supporting the PostgREST builder subset the
+    API uses: select (with count='exact' and many-to-one embeds such as
+    "*, shifts(*)"), insert, upsert(on_conflict, ignore_duplicates), update,
+    delete, the eq/neq/gt/gte/lt/lte/in_/is_ filters and not_, order,
+    limit, range and single. execute() returns an object with .data and
+    .count, so the endpoints run unchanged on either backend.
+
+    The schema mirrors the Supabase tables and migrations, including the
+    employee_changes triggers used by gallery sync. One connection in WAL
+    mode is shared by all threads and serialised with a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("PRAGMA foreign_keys=ON")
+        self._db.executescript(SQLITE_SCHEMA)
+        self._columns = {}
+
+    def table(self, name):
+        return _Query(self, name)
+
+    def columns(self, table):
+        if table not in self._columns:
+            rows = self._db.execute(f'PRAGMA table_info("{table}")').fetchall()
+            if not rows:
+                raise DataStoreError(f"Unknown table: {table}")
+            self._columns[table] = [r["name"] for r in rows]
+        return self._columns[table]
+
+    # --- Row conversion ---
+    def _to_db(self, table, row):
+        json_cols = JSON_COLUMNS.get(table, ())
+        known = set(self.columns(table))
+        unknown = set(row) - known
+        if unknown:
+            raise DataStoreError(f"Unknown column(s) for {table}: {', '.join(sorted(unknown))}")
+        return {
+            k: json.dumps(v) if k in json_cols and v is not None else v
+            for k, v in row.items()
+        }
+
+    def _from_db(self, table, row, wanted=None):
+        json_cols = JSON_COLUMNS.get(table, ())
+        out = {}
+        for k in row.keys():
+            if wanted is not None and k not in wanted:
+                continue
+            v = row[k]
+            out[k] = json.loads(v) if k in json_cols and v is not None else v
+        return out
+
+    # --- Execution ---
+    def _where_sql(self, q):
+        return (" WHERE " + " AND ".join(q._where)) if q._where else ""
+
+    def _execute(self, q):
+        with self._lock:
+            if q._op == "select":
+                return self._select(q)
+            if q._op in ("insert", "upsert"):
+                return self._write(q)
+            if q._op == "update":
+                values = self._to_db(q.table, q._values)
+                sets = ", ".join(f'"{k}" = ?' for k in values)
+                cur = self._db.execute(
+                    f'UPDATE "{q.table}" SET {sets}{self._where_sql(q)} RETURNING *',
+                    list(values.values()) + q._params
+                )
+                return Response([self._from_db(q.table, r) for r in cur.fetchall()])
+            if q._op == "delete":
+                cur = self._db.execute(f'DELETE FROM "{q.table}"{self._where_sql(q)} RETURNING *', q._params)
+                return Response([self._from_db(q.table, r) for r in cur.fetchall()])
+        raise DataStoreError(f"Unsupported operation: {q._op}")
+
+    def _write(self, q):
+        rows = q._values if isinstance(q._values, list) else [q._values]
+        if not rows:
+            return Response([])
+        out = []
+        # One transaction per call: like a PostgREST bulk insert, a batch
+        # with one bad row writes nothing
+        self._db.execute("BEGIN")
+        try:
+            for row in rows:
+                row = dict(row)
+                if q.table in UUID_KEYS and not row.get("id"):
+                    row["id"] = str(uuid.uuid4())
+                row = self._to_db(q.table, row)
+                cols = ", ".join(f'"{k}"' for k in row)
+                sql = f'INSERT INTO "{q.table}" ({cols}) VALUES ({",".join("?" * len(row))})'
+                if q._op == "upsert":
+                    target = q._on_conflict or "id"
+                    if q._ignore_duplicates:
+                        sql += f' ON CONFLICT("{target}") DO NOTHING'
+                    else:
+                        updates = ", ".join(f'"{k}" = excluded."{k}"' for k in row if k != target)
+                        sql += f' ON CONFLICT("{target}") DO ' + (f"UPDATE SET {updates}" if updates else "NOTHING")
+                try:
+                    cur = self._db.execute(sql + " RETURNING *", list(row.values()))
+                except sqlite3.IntegrityError as e:
+                    raise DataStoreError(f"{q.table}: {e}") from e
+                out.extend(self._from_db(q.table, r) for r in cur.fetchall())
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+        return Response(out)
+
+    def _select(self, q):
+        plain, embeds = [], []
+        for part in _split_columns(q._columns):
+            if "(" in part:
+                name, inner = part.split("(", 1)
+                embeds.append((name.strip(), inner.rstrip(")").strip()))
+            else:
+                plain.append(part)
+
+        where = self._where_sql(q)
+        sql = f'SELECT * FROM "{q.table}"{where}'
+        if q._order:
+            sql += " ORDER BY " + ", ".join(q._order)
+        if q._limit is not None:
+            sql += f" LIMIT {q._limit}"
+            if q._offset:
+                sql += f" OFFSET {q._offset}"
+        rows = self._db.execute(sql, q._params).fetchall()
+
+        wanted = None if "*" in plain else set(plain)
+        data = [self._from_db(q.table, r, wanted) for r in rows]
+        for name, inner in embeds:
+            self._embed(q.table, rows, data, name, inner)
+
+        count = None
+        if q._count:
+            count = self._db.execute(f'SELECT COUNT(*) FROM "{q.table}"{where}', q._params).fetchone()[0]
+
+        if q._single:
+            if len(data) != 1:
+                raise DataStoreError(f"JSON object requested, multiple (or no) rows returned ({len(data)})")
+            return Response(data[0], count)
+        return Response(data, count)
+
+    def _embed(self, table, rows, data, relation, inner):
+        fk = RELATIONS.get((table, relation))
+        if fk is None:
+            raise DataStoreError(f"Could not find a relationship between '{table}' and '{relation}'")
+        ids = list({r[fk] for r in rows if r[fk] is not None})
+        related = {}
+        if ids:
+            found = self._db.execute(
+                f'SELECT * FROM "{relation}" WHERE id IN ({",".join("?" * len(ids))})', ids
+            ).fetchall()
+            cols = _split_columns(inner)
+            wanted = None if "*" in cols else set(cols)
+            related = {r["id"]: self._from_db(relation, r, wanted) for r in found}
+        for row, out in zip(rows, data):
+            out[relation] = related.get(row[fk])
+
+
+def open_data_store(backend=None):
+    """
+    Supabase client or SQLiteStore, selected by DATA_BACKEND:
+    "supabase" (default, SUPABASE_URL / SUPABASE_KEY) or "sqlite"
+    (SQLITE_PATH, default attendance.db next to this file) for single-site
+    installs and offline load tests.
+    """
+    backend = (backend or os.getenv("DATA_BACKEND", "supabase")).lower()
+    if backend == "sqlite":
+        path = os.getenv("SQLITE_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "attendance.db"))
+        print(f"Data store: SQLite ({path})")
+        return SQLiteStore(path)
+    if backend != "supabase":
+        raise ValueError(f"Unknown DATA_BACKEND: {backend}")
+    from supabase import create_client
+    return create_client(os.getenv("SUPABASE_URL"), os.getenv("SUPABASE_KEY"))
@@ -0,0 +1,195 @@
+import os
+import time
+import threading
+import cv2
+import face_recognition
+
+# Detection strategies
+#   hog            - dlib HOG on the full-resolution frame (original behaviour)
+#   hog_downscaled - dlib HOG on a downscaled copy, boxes mapped back
+#   haar           - OpenCV Haar cascade on a downscaled grayscale copy
+#   dnn            - OpenCV DNN (res10 SSD face detector) on a downscaled copy
+STRATEGIES = ("hog", "hog_downscaled", "haar", "dnn")
+
+
+class FaceDetector:
+    """
+    Face detection stage used before encoding.
+
+    Every strategy returns boxes as (top, right, bottom, left) in the
+    coordinates of the full-resolution frame, so face_recognition.face_encodings
+    still runs on the full-resolution face and accuracy is unchanged.
+
+    Timing is recorded per strategy (see stats()) and benchmark() runs every
+    available strategy on one frame, so each deployment can pick the fastest
+    one that still finds its faces. A configured strategy this build cannot
+    run (haar without cv2.CascadeClassifier, dnn without its model files)
+    falls back to hog with a warning at construction.
+    """
+
+    def __init__(self, strategy="hog", scale=0.5, upsample=1, model="hog",
+                 dnn_prototxt=None, dnn_model=None, dnn_confidence=0.6):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown detection strategy: {strategy}")
+        self.strategy = strategy
+        self.scale = scale
+        self.upsample = upsample
+        self.model = model            # dlib model for the hog strategies: hog or cnn
+        self.dnn_prototxt = dnn_prototxt
+        self.dnn_model = dnn_model
+        self.dnn_confidence = dnn_confidence
+        # OpenCV detectors are not guaranteed thread-safe: one per thread
+        self._local = threading.local()
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+        if strategy not in self.available():
+            print(f"Warning: face detection strategy '{strategy}' is not available in this build, using 'hog'.")
+            self.strategy = "hog"
+
+    def available(self):
+        strategies = ["hog", "hog_downscaled"]
+        # Haar cascades moved out of the main package in OpenCV 5
+        if hasattr(cv2, "CascadeClassifier"):
+            strategies.append("haar")
+        if self.dnn_prototxt and self.dnn_model and os.path.exists(self.dnn_model):
+            strategies.append("dnn")
+        return strategies
+
+    def detect(self, image, strategy=None):
+        """
+        Face boxes in `image` (RGB) as a list of (top, right, bottom, left).
+        """
+        strategy = strategy or self.strategy
+        start = time.perf_counter()
+        if strategy == "hog":
+            boxes = face_recognition.face_locations(image, self.upsample, self.model)
+        elif strategy == "hog_downscaled":
+            small = self._downscale(image)
+            boxes = self._upscale(face_recognition.face_locations(small, self.upsample, self.model), image)
+        elif strategy == "haar":
+            boxes = self._upscale(self._detect_haar(self._downscale(image)), image)
+        elif strategy == "dnn":
+            boxes = self._upscale(self._detect_dnn(self._downscale(image)), image)
+        else:
+            raise ValueError(f"Unknown detection strategy: {strategy}")
+        self.record(strategy, time.perf_counter() - start, len(boxes))
+        return boxes
+
+    def benchmark(self, image, runs=3):
+        """
+        Run every available strategy `runs` times on one frame.
+        Returns { strategy: {"avg_ms": ..., "faces": ...} }.
+        """
+        results = {}
+        for strategy in self.available():
+            try:
+                start = time.perf_counter()
+                for _ in range(runs):
+                    boxes = self.detect(image, strategy)
+                results[strategy] = {
+                    "avg_ms": round((time.perf_counter() - start) * 1000 / runs, 2),
+                    "faces": len(boxes)
+                }
+            except Exception as e:
+                results[strategy] = {"error": str(e)}
+        return results
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                "strategy": self.strategy,
+                "scale": self.scale,
+                "upsample": self.upsample,
+                "timings": {
+                    name: {
+                        "calls": s["calls"],
+                        "faces": s["faces"],
+                        "avg_ms": round(s["total"] * 1000 / s["calls"], 2) if s["calls"] else 0.0,
+                        "max_ms": round(s["max"] * 1000, 2)
+                    }
+                    for name, s in self._stats.items()
+                }
+            }
+
+    def record(self, strategy, elapsed, faces):
+        """
+        Add one timing sample, also used for locations found outside the
+        detector (e.g. from FaceMesh landmarks).
+        """
+        with self._stats_lock:
+            s = self._stats.setdefault(strategy, {"calls": 0, "faces": 0, "total": 0.0, "max": 0.0})
+            s["calls"] += 1
+            s["faces"] += faces
+            s["total"] += elapsed
+            s["max"] = max(s["max"], elapsed)
+
+    # --- Helpers ---
+
+    def _downscale(self, image):
+        if self.scale >= 1.0:
+            return image
+        return cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+
+    def _upscale(self, boxes, image):
+        if self.scale >= 1.0:
+            return boxes
+        h, w = image.shape[:2]
+        return [
+            (
+                max(0, int(top / self.scale)),
+                min(w, int(right / self.scale)),
+                min(h, int(bottom / self.scale)),
+                max(0, int(left / self.scale))
+            )
+            for top, right, bottom, left in boxes
+        ]
+
+    def _detect_haar(self, image):
+        cascade = getattr(self._local, "haar", None)
+        if cascade is None:
+            cascade = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml"))
+            self._local.haar = cascade
+        gray = cv2.cvtColor(image, cv2.COLOR_RGB2GRAY)
+        faces = cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        return [(y, x + w, y + h, x) for (x, y, w, h) in faces]
+
+    def _detect_dnn(self, image):
+        net = getattr(self._local, "dnn", None)
+        if net is None:
+            net = cv2.dnn.readNetFromCaffe(self.dnn_prototxt, self.dnn_model)
+            self._local.dnn = net
+        h, w = image.shape[:2]
+        # res10 SSD was trained on BGR with means (104, 177, 123); frames here
+        # are RGB, so swapRB reorders the channels (the mean is swapped with them)
+        blob = cv2.dnn.blobFromImage(cv2.resize(image, (300, 300)), 1.0, (300, 300), (104.0, 177.0, 123.0), swapRB=True)
+        net.setInput(blob)
+        detections = net.forward()
+        boxes = []
+        for i in range(detections.shape[2]):
+            if detections[0, 0, i, 2] < self.dnn_confidence:
+                continue
+            x1, y1, x2, y2 = (detections[0, 0, i, 3:7] * [w, h, w, h]).astype(int)
+            boxes.append((max(0, y1), min(w, x2), min(h, y2), max(0, x1)))
+        return boxes
+
+
+def landmarks_to_location(face_landmarks, width, height):
+    """
+    Face box (top, right, bottom, left) from MediaPipe FaceMesh landmarks,
+    framed like a dlib HOG box so it can be passed to
+    face_recognition.face_encodings as known_face_locations.
+
+    The mesh reaches up to the hairline while dlib boxes start around the
+    eyebrows, so the top edge is moved down by 10% of the mesh height.
+    """
+    xs = [lm.x for lm in face_landmarks.landmark]
+    ys = [lm.y for lm in face_landmarks.landmark]
+    left, right = min(xs) * width, max(xs) * width
+    top, bottom = min(ys) * height, max(ys) * height
+    top += 0.1 * (bottom - top)
+    return (
+        max(0, int(top)),
+        min(width, int(right)),
+        min(height, int(bottom)),
+        max(0, int(left))
+    )
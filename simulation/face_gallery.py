@@ -0,0 +1,491 @@
+import threading
+import numpy as np
+
+# dlib / face_recognition encodings are 128-d vectors
+ENCODING_DIM = 128
+
+# Storage modes for the encoding matrix
+#   float64 - same precision as face_recognition (8 bytes / dim)
+#   float32 - half the memory, distances computed in float32
+#   int8    - scalar-quantized with a per-dimension scale (1 byte / dim)
+STORAGE_DTYPES = ("float64", "float32", "int8")
+
+# dlib encodings stay well inside [-0.5, 0.5]; used until calibrate() is
+# called with real data
+DEFAULT_INT8_RANGE = 0.5
+
+# Rows per block when dequantizing int8 rows for a distance computation
+INT8_BLOCK_ROWS = 8192
+
+
+class FaceGallery:
+    """
+    In-memory index of every known face encoding.
+
+    All encodings live in one contiguous matrix. Rows of the same user
+    are kept next to each other, so a user is just (start_row, row_count) and
+    per-user reductions can be done with np.add.reduceat instead of a Python
+    loop over known_faces_cache.
+
+    Writers (register / delete) take a lock and publish a new snapshot tuple.
+    Readers (matching) only grab the current snapshot, so matching never
+    blocks on enrollment and never sees a half-written user. The user_id ->
+    user index map is part of the snapshot: writers only add new keys to it
+    (past the snapshot's user count) and replace it whenever existing
+    entries move, so a snapshot's map always matches its arrays.
+
+    With an `ann` index (see ann_index.IVFIndex) large galleries are searched
+    approximately and only the candidate users are re-ranked exactly.
+    """
+
+    def __init__(self, dim=ENCODING_DIM, ann=None, dtype="float64"):
+        if dtype not in STORAGE_DTYPES:
+            raise ValueError(f"Unsupported gallery dtype: {dtype}")
+        self.dim = dim
+        self.ann = ann
+        self.dtype = dtype
+        self.quantized = dtype == "int8"
+        # Distances are computed in float32 for the compact modes
+        self._compute_dtype = np.float64 if dtype == "float64" else np.float32
+        self.scale = np.full(dim, DEFAULT_INT8_RANGE / 127.0, dtype=np.float32)
+        self.clipped = 0
+
+        self._lock = threading.Lock()
+        self._matrix = np.empty((0, dim), dtype=np.dtype(dtype))
+        self._sq_norms = np.empty(0, dtype=self._compute_dtype)
+        self._starts = np.empty(0, dtype=np.int64)
+        self._counts = np.empty(0, dtype=np.int64)
+        self._user_ids = []   # user index -> user_id
+        self._index = {}      # user_id -> user index
+        self._rows = 0
+        self._publish()
+
+    # --- Encoding / decoding ---
+
+    def calibrate(self, encodings):
+        """
+        Fit the int8 per-dimension scale to representative encodings.
+        Only valid while the gallery is empty (stored rows are not rescaled).
+        """
+        if not self.quantized:
+            return
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, self.dim)
+        if len(encodings) == 0:
+            return
+        with self._lock:
+            if self._rows:
+                raise RuntimeError("calibrate() must be called on an empty gallery")
+            max_abs = np.abs(encodings).max(axis=0)
+            self.scale = (np.maximum(max_abs, 1e-6) / 127.0).astype(np.float32)
+
+    def _encode(self, encodings):
+        if not self.quantized:
+            return encodings.astype(self._matrix.dtype, copy=False)
+        q = np.rint(encodings / self.scale)
+        self.clipped += int(np.count_nonzero(np.abs(q) > 127))
+        return np.clip(q, -127, 127).astype(np.int8)
+
+    def _decode(self, rows):
+        if not self.quantized:
+            return rows
+        return rows.astype(np.float32) * self.scale
+
+    @property
+    def precision(self):
+        """
+        Largest per-dimension difference between an encoding and its stored form.
+        """
+        if self.quantized:
+            return float(self.scale.max()) / 2
+        return 1e-6 if self.dtype == "float32" else 0.0
+
+    # --- Snapshot helpers ---
+
+    def _publish(self):
+        n_users = len(self._user_ids)
+        self._snapshot = (
+            self._matrix[:self._rows],
+            self._sq_norms[:self._rows],
+            self._starts[:n_users],
+            self._counts[:n_users],
+            self._user_ids,
+            self._index,
+        )
+
+    def _reserve(self, extra_rows):
+        # Grow the backing buffers geometrically so appends stay amortised O(1)
+        needed = self._rows + extra_rows
+        if needed > len(self._matrix):
+            capacity = max(needed, 2 * len(self._matrix), 64)
+            matrix = np.empty((capacity, self.dim), dtype=self._matrix.dtype)
+            sq_norms = np.empty(capacity, dtype=self._compute_dtype)
+            matrix[:self._rows] = self._matrix[:self._rows]
+            sq_norms[:self._rows] = self._sq_norms[:self._rows]
+            self._matrix, self._sq_norms = matrix, sq_norms
+
+        n_users = len(self._user_ids)
+        if n_users + 1 > len(self._starts):
+            capacity = max(n_users + 1, 2 * len(self._starts), 64)
+            starts = np.empty(capacity, dtype=np.int64)
+            counts = np.empty(capacity, dtype=np.int64)
+            starts[:n_users] = self._starts[:n_users]
+            counts[:n_users] = self._counts[:n_users]
+            self._starts, self._counts = starts, counts
+
+    # --- Writes ---
+
+    def add(self, user_id, encodings):
+        """
+        Insert or replace all encodings of one user.
+        """
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, self.dim)
+        if len(encodings) == 0:
+            self.remove(user_id)
+            return
+
+        with self._lock:
+            if user_id in self._index:
+                self._remove_locked(user_id)
+
+            stored = self._encode(encodings)
+            decoded = self._decode(stored).astype(self._compute_dtype, copy=False)
+
+            self._reserve(len(stored))
+            n_users = len(self._user_ids)
+            start = self._rows
+
+            # Fill spare capacity first, then make it visible to readers
+            self._matrix[start:start + len(stored)] = stored
+            self._sq_norms[start:start + len(stored)] = np.einsum('ij,ij->i', decoded, decoded)
+            self._starts[n_users] = start
+            self._counts[n_users] = len(stored)
+            self._rows += len(stored)
+            self._index[user_id] = n_users
+            self._user_ids.append(user_id)
+            self._publish()
+
+        if self.ann is not None:
+            self.ann.add(user_id, encodings)
+            self._maybe_rebuild_ann()
+
+    def remove(self, user_id):
+        """
+        Drop a user from the gallery. Returns True if the user was present.
+        """
+        with self._lock:
+            if user_id not in self._index:
+                return False
+            self._remove_locked(user_id)
+            self._publish()
+
+        if self.ann is not None:
+            self.ann.remove(user_id)
+            self._maybe_rebuild_ann()
+        return True
+
+    def _remove_locked(self, user_id):
+        idx = self._index[user_id]
+        n_users = len(self._user_ids)
+        start, count = int(self._starts[idx]), int(self._counts[idx])
+
+        # Compact into fresh buffers so readers holding the old snapshot
+        # keep a consistent view
+        keep = np.ones(self._rows, dtype=bool)
+        keep[start:start + count] = False
+        matrix = np.empty(self._matrix.shape, dtype=self._matrix.dtype)
+        matrix[:self._rows - count] = self._matrix[:self._rows][keep]
+        sq_norms = np.empty(self._sq_norms.shape, dtype=self._compute_dtype)
+        sq_norms[:self._rows - count] = self._sq_norms[:self._rows][keep]
+
+        starts = np.empty_like(self._starts)
+        counts = np.empty_like(self._counts)
+        starts[:idx] = self._starts[:idx]
+        starts[idx:n_users - 1] = self._starts[idx + 1:n_users] - count
+        counts[:idx] = self._counts[:idx]
+        counts[idx:n_users - 1] = self._counts[idx + 1:n_users]
+
+        user_ids = self._user_ids[:idx] + self._user_ids[idx + 1:]
+
+        self._matrix, self._sq_norms = matrix, sq_norms
+        self._starts, self._counts = starts, counts
+        self._user_ids = user_ids
+        self._index = {uid: i for i, uid in enumerate(user_ids)}
+        self._rows -= count
+
+    def load(self, matrix, sq_norms, starts, counts, user_ids, scale=None):
+        """
+        Replace the whole gallery with prebuilt arrays (e.g. a memory-mapped
+        snapshot) stored in this gallery's dtype. The arrays are used as-is,
+        without copying; the first write after this copies them into private
+        memory.
+        """
+        if matrix.dtype != self._matrix.dtype:
+            raise ValueError(f"Expected {self._matrix.dtype} rows, got {matrix.dtype}")
+        with self._lock:
+            if scale is not None:
+                self.scale = np.asarray(scale, dtype=np.float32)
+            self._matrix, self._sq_norms = matrix, sq_norms
+            self._starts = np.asarray(starts, dtype=np.int64)
+            self._counts = np.asarray(counts, dtype=np.int64)
+            self._user_ids = list(user_ids)
+            self._index = {uid: i for i, uid in enumerate(self._user_ids)}
+            self._rows = len(matrix)
+            self._publish()
+
+        if self.ann is not None and self.ann.ready:
+            self.ann.rebuild_async(self.export)
+
+    def arrays(self):
+        """
+        Current (matrix, sq_norms, starts, counts, user_ids) snapshot.
+        """
+        return self._snapshot[:5]
+
+    def clear(self):
+        with self._lock:
+            self._matrix = np.empty((0, self.dim), dtype=self._matrix.dtype)
+            self._sq_norms = np.empty(0, dtype=self._compute_dtype)
+            self._starts = np.empty(0, dtype=np.int64)
+            self._counts = np.empty(0, dtype=np.int64)
+            self._user_ids = []
+            self._index = {}
+            self._rows = 0
+            self._publish()
+
+    # --- ANN index ---
+
+    def export(self):
+        """
+        Current (matrix, owners) pair, where owners[i] is the user of row i.
+        The matrix is returned as float (dequantized for int8 storage).
+        """
+        matrix, _, _, counts, user_ids, _ = self._snapshot
+        owners = np.repeat(np.array(user_ids[:len(counts)], dtype=object), counts).tolist()
+        return self._decode(matrix), owners
+
+    def _ann_usable(self):
+        if self.ann is None or self._rows < self.ann.min_rows:
+            return False
+        if not self.ann.ready:
+            # First use (or gallery just crossed min_rows): build in the
+            # background and keep brute-forcing until it is ready
+            self.ann.rebuild_async(self.export)
+            return False
+        return True
+
+    def _maybe_rebuild_ann(self):
+        if self.ann.needs_rebuild():
+            self.ann.rebuild_async(self.export)
+
+    # --- Reads ---
+
+    def __len__(self):
+        return len(self._snapshot[4])
+
+    def __contains__(self, user_id):
+        return self._user_rows(self._snapshot, user_id) is not None
+
+    def get(self, user_id):
+        """
+        Encodings of one user as a float (k, dim) array, or None.
+        """
+        return self._user_rows(self._snapshot, user_id)
+
+    def _user_rows(self, snapshot, user_id):
+        matrix, _, starts, counts, _, index = snapshot
+        idx = index.get(user_id)
+        if idx is None or idx >= len(starts):
+            return None
+        return self._decode(matrix[starts[idx]:starts[idx] + counts[idx]])
+
+    def same_encodings(self, user_id, encodings):
+        """
+        True if `user_id` is stored with exactly these encodings (up to the
+        storage precision), so re-adding it can be skipped.
+        """
+        current = self.get(user_id)
+        encodings = np.asarray(encodings, dtype=np.float64).reshape(-1, self.dim)
+        if current is None or current.shape != encodings.shape:
+            return False
+        return bool(np.allclose(current, encodings, rtol=0, atol=self.precision + 1e-9))
+
+    def memory_bytes(self):
+        matrix, sq_norms = self._snapshot[:2]
+        return int(matrix.nbytes + sq_norms.nbytes)
+
+    def distances(self, probes):
+        """
+        Euclidean distance of every probe (P, dim) to every gallery row (P, N).
+        """
+        matrix, sq_norms = self._snapshot[:2]
+        probes = np.asarray(probes, dtype=np.float64).reshape(-1, self.dim)
+        return self._pairwise_distances(probes, matrix, sq_norms)
+
+    def match(self, encoding, tolerance=0.5):
+        """
+        Best matching user for one probe encoding.
+
+        Same rule as the old per-user loop: a user is a candidate if any of
+        their encodings is within `tolerance` (face_recognition.compare_faces),
+        and the winner is the candidate with the lowest mean distance, which
+        must itself be below `tolerance`.
+
+        Returns (user_id, mean_distance) or (None, None).
+        """
+        return self.match_many([encoding], tolerance)[0]
+
+    def match_many(self, probes, tolerance=0.5):
+        """
+        Vectorised `match` for a batch of probes. Returns a list of
+        (user_id, mean_distance) tuples, one per probe.
+        """
+        snapshot = self._snapshot
+        matrix, sq_norms, starts, counts, user_ids, _ = snapshot
+        probes = np.asarray(probes, dtype=np.float64).reshape(-1, self.dim)
+        if len(starts) == 0 or len(probes) == 0:
+            return [(None, None)] * len(probes)
+
+        if self._ann_usable():
+            return [self._rerank(snapshot, probe, self.ann.candidates(probe), tolerance) for probe in probes]
+
+        distances = self._pairwise_distances(probes, matrix, sq_norms)
+        means = np.add.reduceat(distances, starts, axis=1) / counts
+        hits = np.logical_or.reduceat(distances <= tolerance, starts, axis=1)
+        means[~hits] = np.inf
+
+        best = np.argmin(means, axis=1)
+        best_distance = means[np.arange(len(probes)), best]
+
+        results = []
+        for idx, distance in zip(best, best_distance):
+            if distance < tolerance:
+                results.append((user_ids[idx], float(distance)))
+            else:
+                results.append((None, None))
+        return results
+
+    def _rerank(self, snapshot, probe, candidates, tolerance):
+        # Exact mean-distance / tolerance rule, restricted to the ANN candidates
+        rows = [(uid, self._user_rows(snapshot, uid)) for uid in candidates]
+        rows = [(uid, enc) for uid, enc in rows if enc is not None]
+        if not rows:
+            return None, None
+
+        matrix = np.concatenate([enc for _, enc in rows])
+        counts = np.array([len(enc) for _, enc in rows])
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        distances = np.linalg.norm(matrix - probe, axis=1)
+        means = np.add.reduceat(distances, starts) / counts
+        hits = np.logical_or.reduceat(distances <= tolerance, starts)
+        means[~hits] = np.inf
+
+        best = int(np.argmin(means))
+        if means[best] < tolerance:
+            return rows[best][0], float(means[best])
+        return None, None
+
+    def near_duplicates(self, encodings, threshold=0.5, exclude=None):
+        """
+        Users with any encoding within `threshold` of any of `encodings`
+        (the photos of a new enrollee), closest first. `exclude` skips one
+        user id, e.g. the enrollee itself when re-registering.
+
+        Returns [(user_id, min_distance, mean_distance)].
+        """
+        snapshot = self._snapshot
+        matrix, sq_norms, starts, counts, user_ids, _ = snapshot
+        probes = np.asarray(encodings, dtype=np.float64).reshape(-1, self.dim)
+        if len(starts) == 0 or len(probes) == 0:
+            return []
+
+        if self._ann_usable():
+            candidates = set()
+            for probe in probes:
+                candidates.update(self.ann.candidates(probe))
+            rows = []
+            for uid in candidates:
+                enc = self._user_rows(snapshot, uid)
+                if enc is not None:
+                    d = np.linalg.norm(enc[None, :, :] - probes[:, None, :], axis=2)
+                    rows.append((uid, float(d.min()), float(d.mean())))
+        else:
+            distances = self._pairwise_distances(probes, matrix, sq_norms)
+            mins = np.minimum.reduceat(distances.min(axis=0), starts)
+            means = np.add.reduceat(distances.sum(axis=0), starts) / (counts * len(probes))
+            hits = np.nonzero(mins <= threshold)[0]
+            rows = [(user_ids[i], float(mins[i]), float(means[i])) for i in hits]
+
+        rows = [r for r in rows if r[1] <= threshold and r[0] != exclude]
+        rows.sort(key=lambda r: r[1])
+        return rows
+
+    def duplicate_clusters(self, threshold=0.5, block_rows=1024):
+        """
+        Groups of different users whose encodings lie within `threshold` of
+        each other, over the whole gallery.
+
+        The N x N distance matrix is never materialised: the upper triangle
+        is walked in `block_rows` x `block_rows` tiles, so peak memory stays
+        at a few tiles whatever the gallery size, and linked users are
+        merged with union-find.
+
+        Returns [{"ids": [...], "pairs": [(user_a, user_b, min_distance)]}],
+        largest cluster first.
+        """
+        matrix, sq_norms, starts, counts, user_ids, _ = self._snapshot
+        n_users = len(counts)
+        owners = np.repeat(np.arange(n_users), counts)
+        parent = list(range(n_users))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        closest = {}   # (user a, user b) -> min distance, a < b
+        for b in range(0, len(matrix), block_rows):
+            block = self._decode(matrix[b:b + block_rows])
+            for c in range(b, len(matrix), block_rows):
+                distances = self._pairwise_distances(block, matrix[c:c + block_rows], sq_norms[c:c + block_rows])
+                ii, jj = np.nonzero(distances <= threshold)
+                dist = distances[ii, jj]
+                ii, jj = ii + b, jj + c
+                keep = (jj > ii) & (owners[ii] != owners[jj])
+                for i, j, d in zip(owners[ii[keep]], owners[jj[keep]], dist[keep]):
+                    key = (min(i, j), max(i, j))
+                    if d < closest.get(key, np.inf):
+                        closest[key] = float(d)
+                    ri, rj = find(i), find(j)
+                    if ri != rj:
+                        parent[ri] = rj
+
+        clusters = {}
+        for (i, j), d in closest.items():
+            cluster = clusters.setdefault(find(i), {"ids": set(), "pairs": []})
+            cluster["ids"].update((user_ids[i], user_ids[j]))
+            cluster["pairs"].append((user_ids[i], user_ids[j], d))
+
+        result = [
+            {"ids": sorted(c["ids"], key=str), "pairs": sorted(c["pairs"], key=lambda p: p[2])}
+            for c in clusters.values()
+        ]
+        result.sort(key=lambda c: len(c["ids"]), reverse=True)
+        return result
+
+    def _pairwise_distances(self, probes, matrix, sq_norms):
+        # ||a - b|| = sqrt(|a|^2 + |b|^2 - 2ab), one matrix product for the batch
+        probes = probes.astype(self._compute_dtype)
+        if self.quantized:
+            # a . (scale * q) == (a * scale) . q, dequantized block by block
+            scaled = probes * self.scale
+            dots = np.empty((len(probes), len(matrix)), dtype=self._compute_dtype)
+            for b in range(0, len(matrix), INT8_BLOCK_ROWS):
+                block = matrix[b:b + INT8_BLOCK_ROWS].astype(self._compute_dtype)
+                dots[:, b:b + INT8_BLOCK_ROWS] = scaled @ block.T
+        else:
+            dots = probes @ matrix.T
+
+        sq = np.einsum('ij,ij->i', probes, probes)[:, None] + sq_norms[None, :] - 2.0 * dots
+        np.maximum(sq, 0.0, out=sq)
+        return np.sqrt(sq)
@@ -0,0 +1,91 @@
+import time
+import threading
+
+
+def iou(a, b):
+    """
+    Intersection over union of two (top, right, bottom, left) boxes.
+    """
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    area_a = max(0, a[1] - a[3]) * max(0, a[2] - a[0])
+    area_b = max(0, b[1] - b[3]) * max(0, b[2] - b[0])
+    union = area_a + area_b - inter
+    return inter / union if union > 0 else 0.0
+
+
+class FaceTracker:
+    """
+    Single-face tracker for one kiosk session.
+
+    After a face has been identified, following frames whose face box
+    overlaps the track (IoU >= iou_threshold, checked by the frame pipeline)
+    reuse the identity instead of running encoding and gallery matching
+    again. The track is dropped as soon as a frame has no face or the box
+    jumps, and a full encoding is forced every `reverify_interval` seconds.
+    """
+
+    # Totals over all sessions, for /metrics
+    _stats_lock = threading.Lock()
+    totals = {"tracked_frames": 0, "encoded_frames": 0, "tracks_started": 0, "tracks_lost": 0}
+
+    def __init__(self, iou_threshold=0.5, reverify_interval=3.0):
+        self.iou_threshold = iou_threshold
+        self.reverify_interval = reverify_interval
+        self.box = None
+        self.user_id = None
+        self.name = None
+        self.distance = None
+        self.verified_at = 0.0
+
+    @classmethod
+    def _count(cls, key):
+        with cls._stats_lock:
+            cls.totals[key] += 1
+
+    @classmethod
+    def stats(cls):
+        with cls._stats_lock:
+            return dict(cls.totals)
+
+    def hint(self):
+        """
+        Box the pipeline may compare against to skip encoding, or None when
+        there is no track or it is due for re-verification.
+        """
+        if self.box is None:
+            return None
+        if time.monotonic() - self.verified_at >= self.reverify_interval:
+            return None
+        return self.box
+
+    def follow(self, box):
+        """
+        The pipeline matched this frame's face to the track.
+        Returns (user_id, name, distance) of the tracked identity.
+        """
+        self.box = box
+        self._count("tracked_frames")
+        return self.user_id, self.name, self.distance
+
+    def identified(self, box, user_id, name, distance):
+        """
+        A full encoding + match ran on this frame. Starts (or refreshes) the
+        track when a known face was found, drops it otherwise.
+        """
+        self._count("encoded_frames")
+        if user_id is None:
+            self.lose()
+            return
+        if self.user_id != user_id:
+            self._count("tracks_started")
+        self.box = box
+        self.user_id, self.name, self.distance = user_id, name, distance
+        self.verified_at = time.monotonic()
+
+    def lose(self):
+        if self.box is not None:
+            self._count("tracks_lost")
+        self.box = None
+        self.user_id = self.name = self.distance = None
@@ -0,0 +1,110 @@
+import threading
+
+# take() result telling a drain loop its session was closed while it ran
+CLOSED = object()
+
+
+class LatestFrameBuffer:
+    """
+    Per-session ingestion buffer with latest-frame-wins semantics.
+
+    Each session has a single slot. A frame arriving while the previous one
+    is still waiting replaces it (the stale frame is counted as dropped), and
+    at most one drain loop per session processes frames. Server load stays
+    bounded by the number of sessions and a kiosk result is never more than
+    about one processing time old, whatever the client frame rate.
+
+    close() ends a session. If its drain loop is mid-frame, the loop may
+    still write per-session state, so the session is only marked closed and
+    the loop gets CLOSED from its next take() and does the final cleanup.
+    A frame offered before that (a quick reconnect on the same sid) reopens
+    the session instead of being dropped with it; the sid is active again,
+    so its later disconnect or TTL eviction releases it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = {}       # sid -> (seq, payload) waiting to be processed
+        self._draining = set() # sids with an active drain loop
+        self._closed = set()   # closed sids whose drain loop has not stopped yet
+        self._sessions = {}    # sid -> {"received", "processed", "dropped", "last_seq"}
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.reopened = 0
+
+    def offer(self, sid, seq, payload):
+        """
+        Store the newest frame of `sid`. Returns True if the caller must
+        start a drain loop for this session (none is running yet).
+        """
+        with self._lock:
+            counters = self._sessions.setdefault(sid, {"received": 0, "processed": 0, "dropped": 0, "last_seq": None})
+            if seq is None:
+                # Old clients send no sequence number: number frames here
+                seq = counters["received"]
+            if sid in self._closed:
+                self._closed.discard(sid)
+                self.reopened += 1
+            if sid in self._slots:
+                counters["dropped"] += 1
+                self.dropped += 1
+            self._slots[sid] = (seq, payload)
+            counters["received"] += 1
+            self.received += 1
+            if sid in self._draining:
+                return False
+            self._draining.add(sid)
+            return True
+
+    def take(self, sid):
+        """
+        Next (seq, payload) to process, or None when the slot is empty, in
+        which case the drain loop of `sid` must stop. CLOSED means the
+        session was closed meanwhile: the loop must stop and release it.
+        """
+        with self._lock:
+            if sid in self._closed:
+                self._closed.discard(sid)
+                self._draining.discard(sid)
+                return CLOSED
+            item = self._slots.pop(sid, None)
+            if item is None:
+                self._draining.discard(sid)
+                return None
+            counters = self._sessions.get(sid)
+            if counters is not None:
+                counters["processed"] += 1
+                counters["last_seq"] = item[0]
+            self.processed += 1
+            return item
+
+    def close(self, sid):
+        """
+        Close a session. Returns True if the caller must release it now;
+        False if its drain loop is running and will do so when it stops.
+        """
+        with self._lock:
+            self._slots.pop(sid, None)
+            if sid in self._draining:
+                self._closed.add(sid)
+                return False
+            return True
+
+    def drop_session(self, sid):
+        with self._lock:
+            self._slots.pop(sid, None)
+            self._sessions.pop(sid, None)
+            self._closed.discard(sid)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "received": self.received,
+                "processed": self.processed,
+                "dropped": self.dropped,
+                "pending": len(self._slots),
+                "closing": len(self._closed),
+                "reopened": self.reopened,
+                "sessions": {sid: dict(c) for sid, c in self._sessions.items()}
+            }
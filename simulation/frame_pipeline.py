@@ -0,0 +1,276 @@
+"""
+Per-frame analysis for live recognition: liveness (MediaPipe FaceMesh blink
+check), face location and 128-d encoding.
+
+No Flask, Supabase or gallery access here, so the same code runs in the app
+process and inside recognition worker processes (see recognition_worker.py).
+"""
+import time
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+import numpy as np
+import face_recognition
+
+from face_detection import landmarks_to_location
+from face_tracker import iou
+
+# Try importing mediapipe (might fail on Python 3.13 or Apple Silicon)
+try:
+    import mediapipe as mp
+    mp_face_mesh = mp.solutions.face_mesh
+    HAS_MEDIAPIPE = True
+except ImportError:
+    print("Warning: mediapipe not found. Live recognition is refused unless LIVENESS_REQUIRED=false.")
+    HAS_MEDIAPIPE = False
+
+# --- Liveness Detection Setup ---
+# SocketIO threading mode: requests are concurrent. MediaPipe FaceMesh is not strictly thread-safe.
+# Instantiating per frame is expensive, so instances are pooled (FaceMeshPool) and each
+# frame checks one out exclusively.
+
+# Let's use a class to manage state per client
+class ClientState:
+    def __init__(self):
+        self.blink_counter = 0
+        self.total_blinks = 0
+        self.last_blink_time = None
+        self.is_live = False
+
+
+class FaceMeshPool:
+    """
+    Bounded pool of FaceMesh instances shared by all sessions.
+
+    Instances are created lazily, on the first frame that needs one, up to
+    `size`. Each frame checks an instance out exclusively; when all `size`
+    are busy the frame waits (at most `timeout` seconds). An idle instance
+    last used by the same session is preferred, so FaceMesh keeps tracking
+    that session's face between frames. Memory scales with the number of
+    kiosks sending frames at the same time, not with open sockets.
+    """
+
+    def __init__(self, size=4, timeout=5.0):
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._idle = []      # [(id(owner), FaceMesh)], most recently returned last
+        self._created = 0
+        self.checkouts = 0
+        self.waits = 0
+        self.timeouts = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def enabled(self):
+        return HAS_MEDIAPIPE
+
+    def _create(self):
+        return mp_face_mesh.FaceMesh(
+            max_num_faces=1,
+            refine_landmarks=True,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        )
+
+    def _acquire(self, owner):
+        start = time.perf_counter()
+        with self._cond:
+            waited = False
+            while not self._idle and self._created >= self.size:
+                waited = True
+                remaining = None if self.timeout is None else self.timeout - (time.perf_counter() - start)
+                if remaining is not None and remaining <= 0:
+                    self.timeouts += 1
+                    return None
+                self._cond.wait(remaining)
+            elapsed = time.perf_counter() - start
+            self.checkouts += 1
+            if waited:
+                self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+            if self._idle:
+                for i in range(len(self._idle) - 1, -1, -1):
+                    if self._idle[i][0] == id(owner):
+                        return self._idle.pop(i)[1]
+                return self._idle.pop()[1]
+            self._created += 1
+        try:
+            return self._create()
+        except Exception:
+            with self._cond:
+                self._created -= 1
+                self._cond.notify()
+            raise
+
+    def _release(self, owner, mesh):
+        with self._cond:
+            self._idle.append((id(owner), mesh))
+            self._cond.notify()
+
+    @contextmanager
+    def checkout(self, owner=None):
+        """
+        Exclusive FaceMesh for one frame of `owner` (the session's
+        ClientState), or None if none became free within the timeout.
+        """
+        mesh = self._acquire(owner)
+        try:
+            yield mesh
+        finally:
+            if mesh is not None:
+                self._release(owner, mesh)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "in_use": self._created - len(self._idle),
+                "checkouts": self.checkouts,
+                "waits": self.waits,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_time * 1000 / self.waits, 2) if self.waits else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 2)
+            }
+
+# Constants for EAR
+EYE_AR_THRESH = 0.25 # Threshold below which eye is considered closed
+EYE_AR_CONSEC_FRAMES = 3 # Increased to 3 to filter out noise
+LIVENESS_TIMEOUT = 5.0 # Seconds liveness remains valid after a blink
+
+# Eye Landmarks (MediaPipe)
+# Left eye indices
+LEFT_EYE = [362, 385, 387, 263, 373, 380]
+# Right eye indices
+RIGHT_EYE = [33, 160, 158, 133, 153, 144]
+# Both eyes, p1..p6 each: rows 0-5 left eye, rows 6-11 right eye
+EYE_INDICES = LEFT_EYE + RIGHT_EYE
+
+def eye_points(face_landmarks, width, height):
+    # Only the 12 eye landmarks, in pixels, as a (12, 2) array
+    lm = face_landmarks.landmark
+    return np.array([(lm[i].x * width, lm[i].y * height) for i in EYE_INDICES])
+
+def calculate_ear(points):
+    # EAR of both eyes at once from eye_points(): array([left, right])
+    eyes = points.reshape(2, 6, 2)
+    # Euclidean distances between vertical eye landmarks (p2-p6, p3-p5)
+    vertical = np.linalg.norm(eyes[:, [1, 2]] - eyes[:, [5, 4]], axis=2).sum(axis=1)
+    # Euclidean distance between horizontal eye landmarks (p1-p4)
+    horizontal = np.linalg.norm(eyes[:, 0] - eyes[:, 3], axis=1)
+    return vertical / (2.0 * horizontal)
+
+
+def scale_location(location, scale):
+    top, right, bottom, left = location
+    return (int(top * scale), int(right * scale), int(bottom * scale), int(left * scale))
+
+
+def analyze_frame(image, state, detector, location_source="detector", track_box=None, track_iou=0.5,
+                  full_frame=None, scale=1, mesh_pool=None, liveness_required=True):
+    """
+    Liveness check, face location and encoding for one RGB frame.
+
+    `state` is the ClientState of the session (None for one-off HTTP
+    requests, which skip liveness), and `mesh_pool` the FaceMeshPool the
+    liveness check borrows a FaceMesh from. Without a usable pool (mediapipe
+    missing) session frames fail with "Liveness unavailable", unless
+    `liveness_required` is False. When `track_box` is given (the box of an
+    already identified face, see face_tracker.py) and this frame's face
+    overlaps it by at least `track_iou`, encoding is skipped.
+
+    `image` may be a reduced decode (1/`scale` of the frame): liveness and
+    detection run on it, and `full_frame()` is only called for the full
+    resolution image when a face has to be encoded. Returned locations are
+    always in full-frame coordinates.
+
+    Returns (encoding, failure, location):
+      - encoding of the first face, with its location
+      - None, None, location when the face continues the track
+      - None and the response to send back when the frame fails
+    """
+    # Face box derived from FaceMesh, reused instead of a second detection pass
+    mesh_location = None
+
+    # 1. Liveness Detection (MediaPipe)
+    if state and mesh_pool is not None and mesh_pool.enabled:
+        # Check if liveness is still valid
+        if state.last_blink_time and (datetime.now() - state.last_blink_time).total_seconds() < LIVENESS_TIMEOUT:
+            state.is_live = True
+        else:
+            state.is_live = False
+
+        # Process frame for blinks
+        # MediaPipe needs RGB (already converted)
+        with mesh_pool.checkout(state) as face_mesh:
+            if face_mesh is None:
+                return None, {"success": False, "error": "Server busy", "is_live": state.is_live}, None
+            results = face_mesh.process(image)
+
+        if results.multi_face_landmarks:
+            for face_landmarks in results.multi_face_landmarks:
+                h, w, _ = image.shape
+                if mesh_location is None and location_source == "facemesh":
+                    mesh_start = time.perf_counter()
+                    mesh_location = landmarks_to_location(face_landmarks, w, h)
+                    detector.record("facemesh", time.perf_counter() - mesh_start, 1)
+
+                leftEAR, rightEAR = calculate_ear(eye_points(face_landmarks, w, h))
+                ear = (leftEAR + rightEAR) / 2.0
+                # print(f"EAR: {ear:.2f} | Count: {state.blink_counter}") # Debug EAR
+
+                if ear < EYE_AR_THRESH:
+                    state.blink_counter += 1
+                else:
+                    if state.blink_counter >= EYE_AR_CONSEC_FRAMES:
+                        state.total_blinks += 1
+                        state.last_blink_time = datetime.now()
+                        state.is_live = True # Liveness confirmed!
+                        print(f"Blink detected! Total: {state.total_blinks}")
+                    state.blink_counter = 0
+
+        # If NOT live, we can choose to return early or return a specific status
+        # To secure it: strictly block recognition if not live.
+        if not state.is_live:
+            return None, {
+                "success": False,
+                "error": "Liveness Check Failed",
+                "message": "Silakan berkedip untuk verifikasi.",
+                "is_live": False
+            }, None
+    elif state and liveness_required:
+        # mediapipe missing: fail closed rather than skip the check
+        return None, {"success": False, "error": "Liveness unavailable", "is_live": False}, None
+    elif state:
+        # Liveness explicitly disabled (LIVENESS_REQUIRED=false)
+        state.is_live = True
+
+    # 2. Face Recognition (dlib)
+    # Only proceed if live
+
+    # Detection may run on a downscaled copy, encoding always uses the full frame
+    if mesh_location:
+        face_locations = [mesh_location]
+    else:
+        face_locations = detector.detect(image)
+
+    if scale != 1:
+        face_locations = [scale_location(loc, scale) for loc in face_locations]
+
+    # Same face as the tracked one: skip the 128-d encoding entirely
+    if track_box is not None and face_locations and iou(face_locations[0], track_box) >= track_iou:
+        return None, None, face_locations[0]
+
+    if full_frame is not None and face_locations:
+        image = full_frame()
+        if image is None:
+            return None, {"success": False, "error": "Processing error"}, None
+    face_encodings = face_recognition.face_encodings(image, face_locations[:1])
+
+    if not face_encodings:
+        return None, {"success": False, "error": "No face detected", "is_live": state.is_live if state else False}, None
+
+    return face_encodings[0], None, face_locations[0]
@@ -0,0 +1,152 @@
+import os
+import json
+import time
+import uuid
+import threading
+import numpy as np
+
+# Bump when the on-disk layout changes; older snapshots are ignored
+SNAPSHOT_VERSION = 1
+SIDECAR_NAME = "gallery.json"
+
+
+def save_snapshot(directory, gallery, people, sync_version=None):
+    """
+    Write the gallery to `directory` as:
+      encodings-<token>.npy  (rows, dim) encoding matrix
+      norms-<token>.npy      squared row norms used by the matcher
+      gallery.json           version, row ranges and id/name/phone per user
+
+    `sync_version` is the last employee_changes id contained in the gallery,
+    so a worker mapping the snapshot can catch up with a delta sync.
+
+    Data files get a fresh token on every write and gallery.json is replaced
+    atomically last, so a reader never maps a half-written snapshot. Files of
+    the previous snapshot are unlinked afterwards; processes that already
+    mapped them keep working (POSIX keeps unlinked mappings alive).
+    """
+    os.makedirs(directory, exist_ok=True)
+    matrix, sq_norms, starts, counts, user_ids = gallery.arrays()
+    token = uuid.uuid4().hex[:12]
+    encodings_file = f"encodings-{token}.npy"
+    norms_file = f"norms-{token}.npy"
+
+    np.save(os.path.join(directory, encodings_file), np.ascontiguousarray(matrix))
+    np.save(os.path.join(directory, norms_file), np.ascontiguousarray(sq_norms))
+
+    users = []
+    for uid, start, count in zip(user_ids, starts.tolist(), counts.tolist()):
+        info = people.get(uid, {})
+        users.append({
+            "id": uid,
+            "name": info.get("name"),
+            "phone_number": info.get("phone_number"),
+            "start": start,
+            "count": count
+        })
+
+    sidecar = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": time.time(),
+        "dim": int(matrix.shape[1]) if matrix.ndim == 2 else gallery.dim,
+        "dtype": str(matrix.dtype),
+        "scale": gallery.scale.tolist() if gallery.quantized else None,
+        "rows": int(len(matrix)),
+        "source_count": len(users),
+        "sync_version": sync_version,
+        "encodings_file": encodings_file,
+        "norms_file": norms_file,
+        "users": users
+    }
+
+    previous = _read_sidecar(directory)
+    sidecar_path = os.path.join(directory, SIDECAR_NAME)
+    tmp_path = f"{sidecar_path}.{token}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(sidecar, f)
+    os.replace(tmp_path, sidecar_path)
+
+    if previous:
+        for key in ("encodings_file", "norms_file"):
+            old = previous.get(key)
+            if old and old != sidecar[key]:
+                try:
+                    os.remove(os.path.join(directory, old))
+                except OSError:
+                    pass
+    return sidecar
+
+
+def load_snapshot(directory, max_age=None, source_count=None, dtype=None):
+    """
+    Map a snapshot written by save_snapshot.
+
+    Returns (sidecar, matrix, sq_norms) with both arrays memory-mapped
+    read-only, or None when the snapshot is missing, from another format
+    version, stored in another `dtype` than the gallery uses, older than
+    `max_age` seconds, or holds a different number of users than
+    `source_count` (employees with a face in the database).
+    """
+    sidecar = _read_sidecar(directory)
+    if not sidecar or sidecar.get("version") != SNAPSHOT_VERSION:
+        return None
+    if dtype is not None and sidecar.get("dtype") != dtype:
+        return None
+    if max_age is not None and time.time() - sidecar.get("created_at", 0) > max_age:
+        return None
+    if source_count is not None and sidecar.get("source_count") != source_count:
+        return None
+
+    try:
+        matrix = np.load(os.path.join(directory, sidecar["encodings_file"]), mmap_mode="r")
+        sq_norms = np.load(os.path.join(directory, sidecar["norms_file"]), mmap_mode="r")
+    except (OSError, ValueError, KeyError):
+        return None
+    if len(matrix) != sidecar["rows"] or len(sq_norms) != sidecar["rows"]:
+        return None
+    return sidecar, matrix, sq_norms
+
+
+def _read_sidecar(directory):
+    try:
+        with open(os.path.join(directory, SIDECAR_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class SnapshotWriter:
+    """
+    Debounced background writer: many register/delete calls in a row
+    result in a single snapshot write `delay` seconds after the first one.
+    """
+
+    def __init__(self, directory, gallery, people, delay=30.0, version_getter=None):
+        self.directory = directory
+        self.gallery = gallery
+        self.people = people
+        self.delay = delay
+        self.version_getter = version_getter
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def schedule(self):
+        with self._lock:
+            if self._timer is not None:
+                return
+            self._timer = threading.Timer(self.delay, self._run)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def write_now(self):
+        try:
+            version = self.version_getter() if self.version_getter else None
+            save_snapshot(self.directory, self.gallery, self.people, sync_version=version)
+            print(f"Gallery snapshot written ({len(self.gallery)} users).")
+        except Exception as e:
+            print(f"Failed to write gallery snapshot: {e}")
+
+    def _run(self):
+        with self._lock:
+            self._timer = None
+        self.write_now()
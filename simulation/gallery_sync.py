@@ -0,0 +1,168 @@
+import threading
+import time
+
+# Columns needed to (re)build one gallery entry
+EMPLOYEE_COLUMNS = "id, name, phone_number, face_encoding"
+
+# Largest id jump whose missing ids are tracked as gaps (bigger jumps are
+# sequence resets or bulk deletes of the log, not in-flight transactions)
+MAX_GAP_IDS = 1000
+
+
+class GallerySync:
+    """
+    Incremental sync of the in-memory gallery from the `employee_changes`
+    log (see gallery_sync_migration.sql).
+
+    `version` is the highest change id already applied. Each sync fetches
+    only newer change rows, collapses them to the last op per employee,
+    re-fetches the upserted employees in one query and hands the results to
+    `on_upsert(employee_row)` / `on_delete(employee_id)`. Cost is therefore
+    proportional to churn, not to headcount.
+
+    Change ids are assigned at insert, not at commit, so a row with a lower
+    id can become visible after `version` has moved past it. Ids skipped
+    below `version` are kept as gaps and looked up again on every sync for
+    `gap_timeout` seconds (after that they are taken to be rolled back).
+    A change found late is applied from the employee's current row rather
+    than its op, so it cannot undo a newer change already applied.
+    """
+
+    def __init__(self, supabase, on_upsert, on_delete, interval=30.0, batch_size=500, gap_timeout=300.0):
+        self.supabase = supabase
+        self.on_upsert = on_upsert
+        self.on_delete = on_delete
+        self.interval = interval
+        self.batch_size = batch_size
+        self.gap_timeout = gap_timeout
+        self.version = None
+        self.late_changes = 0
+        self._gaps = {}   # change id skipped below version -> time first seen
+        self.last_sync = None
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def head(self):
+        """
+        Latest change id in the database (0 when the log is empty).
+        Read this *before* a full load so nothing is missed in between.
+        """
+        res = self.supabase.table('employee_changes').select("id").order('id', desc=True).limit(1).execute()
+        return res.data[0]['id'] if res.data else 0
+
+    def init_version(self, version=None):
+        try:
+            self.version = self.head() if version is None else version
+        except Exception as e:
+            # Migration not applied yet: keep working without delta sync
+            print(f"Gallery sync disabled (employee_changes unavailable): {e}")
+            self.enabled = False
+
+    def sync_once(self):
+        """
+        Apply all pending changes. Returns the number of employees touched.
+        """
+        if not self.enabled or self.version is None:
+            return 0
+
+        with self._lock:
+            touched = self._sync_gaps()
+            while True:
+                res = self.supabase.table('employee_changes')\
+                    .select("id, employee_id, op")\
+                    .gt('id', self.version)\
+                    .order('id')\
+                    .limit(self.batch_size)\
+                    .execute()
+                changes = res.data
+                if not changes:
+                    break
+
+                # Last op per employee wins
+                latest = {}
+                for change in changes:
+                    latest[change['employee_id']] = change['op']
+                self._apply(latest)
+                self._track_gaps(changes)
+
+                touched += len(latest)
+                self.version = changes[-1]['id']
+                if len(changes) < self.batch_size:
+                    break
+
+            self.last_sync = time.time()
+            return touched
+
+    def _apply(self, latest):
+        upsert_ids = [emp_id for emp_id, op in latest.items() if op != 'delete']
+        found = set()
+        if upsert_ids:
+            emp_res = self.supabase.table('employees').select(EMPLOYEE_COLUMNS).in_('id', upsert_ids).execute()
+            for emp in emp_res.data:
+                self.on_upsert(emp)
+                found.add(emp['id'])
+
+        # Deleted, or upserted and deleted again before we looked
+        for emp_id in latest:
+            if emp_id not in found:
+                self.on_delete(emp_id)
+
+    def _track_gaps(self, changes):
+        now = time.time()
+        previous = self.version
+        for change in changes:
+            if 1 < change['id'] - previous <= MAX_GAP_IDS:
+                for missing in range(previous + 1, change['id']):
+                    self._gaps.setdefault(missing, now)
+            previous = change['id']
+
+    def _sync_gaps(self):
+        """
+        Apply changes that committed after `version` passed their id.
+        Returns the number of employees touched.
+        """
+        expired = time.time() - self.gap_timeout
+        self._gaps = {change_id: seen for change_id, seen in self._gaps.items() if seen >= expired}
+        if not self._gaps:
+            return 0
+        res = self.supabase.table('employee_changes')\
+            .select("id, employee_id, op")\
+            .in_('id', list(self._gaps))\
+            .execute()
+        if not res.data:
+            return 0
+        # Re-read current state instead of trusting the (older) op
+        latest = {change['employee_id']: 'upsert' for change in res.data}
+        self._apply(latest)
+        for change in res.data:
+            self._gaps.pop(change['id'], None)
+        self.late_changes += len(res.data)
+        return len(latest)
+
+    def start(self):
+        if self._thread is not None or not self.enabled:
+            return
+
+        def loop():
+            while True:
+                time.sleep(self.interval)
+                try:
+                    touched = self.sync_once()
+                    if touched:
+                        print(f"Gallery sync: applied {touched} change(s), version {self.version}")
+                except Exception as e:
+                    print(f"Gallery sync error: {e}")
+
+        self._thread = threading.Thread(target=loop, daemon=True)
+        self._thread.start()
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "version": self.version,
+            "last_sync": self.last_sync,
+            "pending_gaps": len(self._gaps),
+            "late_changes": self.late_changes,
+            "interval": self.interval
+        }
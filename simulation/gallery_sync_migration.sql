@@ -0,0 +1,34 @@
+-- Change log for incremental gallery sync (see gallery_sync.py)
+-- Every insert/update/delete on employees appends a row here. The API keeps the
+-- highest id it has applied as its sync version and only fetches newer rows.
+CREATE TABLE IF NOT EXISTS employee_changes (
+    id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    employee_id TEXT NOT NULL,
+    op TEXT NOT NULL, -- 'upsert' or 'delete'
+    changed_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+ALTER TABLE employees ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION log_employee_change() RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_OP = 'DELETE' THEN
+        INSERT INTO employee_changes (employee_id, op) VALUES (OLD.id, 'delete');
+        RETURN OLD;
+    END IF;
+    NEW.updated_at = NOW();
+    INSERT INTO employee_changes (employee_id, op) VALUES (NEW.id, 'upsert');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS employees_change_log ON employees;
+CREATE TRIGGER employees_change_log
+    BEFORE INSERT OR UPDATE OR DELETE ON employees
+    FOR EACH ROW EXECUTE FUNCTION log_employee_change();
+
+-- Optional: prune old entries once all API instances have caught up
+-- DELETE FROM employee_changes WHERE changed_at < NOW() - INTERVAL '30 days';
+
+ALTER TABLE employee_changes ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow Public Access" ON employee_changes FOR ALL USING (true) WITH CHECK (true);
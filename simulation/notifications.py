@@ -1,24 +1,358 @@
+import os
+import heapq
+import itertools
+import queue
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
 import json
 from datetime import datetime
 
+
+class TokenBucket:
+    """
+    `rate` tokens per second, at most `capacity` saved up.
+    """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self):
+        """
+        Take one token. Returns how many seconds the caller must wait before
+        using it (0 when one was available).
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class NotificationDispatcher:
+    """
+    Sends gateway messages from a bounded in-process queue.
+
+    submit() never blocks: when the queue is full the message goes straight
+    to the dead-letter file. A few worker threads (started on first use)
+    post through one keep-alive requests.Session. Connection errors, timeouts
+    and 5xx answers are retried with exponential backoff; messages that still
+    fail, or get a 4xx, are appended to the dead-letter JSONL file.
+
+    A message over its recipient's rate limit is not waited for in the
+    worker: it is parked in a heap keyed by the time its token is due, and
+    a scheduler thread puts it back on the queue then, so one busy recipient
+    does not hold up everyone else. close() drains what it can at shutdown
+    and dead-letters the rest.
+    """
+
+    def __init__(self, url, workers=2, queue_size=1000, max_retries=3, backoff=1.0,
+                 timeout=10, dead_letter_path=None, rate_per_minute=6, burst=3, max_rate_wait=120.0):
+        self.url = url
+        # Per-recipient token buckets: at most `rate_per_minute` messages to
+        # one number (bursts of `burst`); messages that would wait longer
+        # than `max_rate_wait` seconds are dead-lettered instead
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.max_rate_wait = max_rate_wait
+        self._buckets = {}
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.dead_letter_path = dead_letter_path
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._session = requests.Session()
+        self._session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self._session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=workers))
+        self._lock = threading.Lock()
+        self._threads = []
+        self._scheduler = None
+        # Rate-limited messages: heap of (ready_at, seq, payload)
+        self._delayed = []
+        self._delayed_cond = threading.Condition(self._lock)
+        self._seq = itertools.count()
+        self.counters = {"queued": 0, "sent": 0, "retried": 0, "failed": 0, "dropped": 0, "rate_limited": 0}
+        self.send_time = 0.0
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.counters[key] += n
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f"notify-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+            self._scheduler = threading.Thread(target=self._schedule, name="notify-delayed", daemon=True)
+            self._scheduler.start()
+
+    def submit(self, payload):
+        self._start()
+        self._enqueue(payload, False)
+
+    def _enqueue(self, payload, rate_checked):
+        try:
+            self._queue.put_nowait((payload, rate_checked))
+            if not rate_checked:
+                self._count("queued")
+        except queue.Full:
+            self._count("dropped")
+            self._dead_letter(payload, "queue full", 0)
+
+    def _run(self):
+        while True:
+            payload, rate_checked = self._queue.get()
+            try:
+                self._deliver(payload, rate_checked)
+            finally:
+                self._queue.task_done()
+
+    def _schedule(self):
+        # Moves rate-limited messages back to the queue once their token is due
+        while True:
+            with self._delayed_cond:
+                while not self._delayed or self._delayed[0][0] > time.monotonic():
+                    timeout = self._delayed[0][0] - time.monotonic() if self._delayed else None
+                    self._delayed_cond.wait(timeout)
+                _, _, payload = heapq.heappop(self._delayed)
+            self._enqueue(payload, True)
+
+    def _rate_wait(self, number):
+        if not self.rate_per_minute:
+            return 0.0
+        with self._lock:
+            bucket = self._buckets.get(number)
+            if bucket is None:
+                bucket = self._buckets[number] = TokenBucket(self.rate_per_minute / 60.0, self.burst)
+            wait = bucket.reserve()
+            if wait > self.max_rate_wait:
+                bucket.tokens += 1   # not sent, give the token back
+        return wait
+
+    def _deliver(self, payload, rate_checked=False):
+        wait = 0.0 if rate_checked else self._rate_wait(payload.get("number"))
+        if wait > self.max_rate_wait:
+            self._count("rate_limited")
+            self._dead_letter(payload, "rate limited", 0)
+            return
+        if wait:
+            with self._delayed_cond:
+                self.counters["rate_limited"] += 1
+                heapq.heappush(self._delayed, (time.monotonic() + wait, next(self._seq), payload))
+                self._delayed_cond.notify()
+            return
+
+        error = None
+        for attempt in range(1, self.max_retries + 2):
+            start = time.perf_counter()
+            try:
+                # Timeout kept at 10s to handle getNumberId latency
+                response = self._session.post(self.url, json=payload, timeout=self.timeout)
+                if response.status_code < 400:
+                    with self._lock:
+                        self.counters["sent"] += 1
+                        self.send_time += time.perf_counter() - start
+                    print(f"✅ WA Sent to {payload.get('number')}")
+                    return
+                error = f"HTTP {response.status_code}"
+                if response.status_code < 500:
+                    break   # rejected, retrying will not help
+            except requests.RequestException as e:
+                error = str(e)
+            if attempt <= self.max_retries:
+                self._count("retried")
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+        self._count("failed")
+        print(f"⚠️ Failed to send WA (Gateway might be down): {error}")
+        self._dead_letter(payload, error, attempt)
+
+    def _dead_letter(self, payload, error, attempts):
+        if not self.dead_letter_path:
+            return
+        entry = {"time": datetime.now().isoformat(), "error": error, "attempts": attempts, "payload": payload}
+        try:
+            with self._lock, open(self.dead_letter_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"⚠️ Could not write notification dead letter: {e}")
+
+    def flush(self, timeout=None):
+        """
+        Wait until the queue and the delayed messages are drained (or
+        `timeout` seconds passed).
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks or self._delayed:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self, timeout=10.0):
+        """
+        Shutdown: give the queue up to `timeout` seconds, then dead-letter
+        whatever is still queued or delayed so nothing is lost silently.
+        """
+        if self.flush(timeout):
+            return
+        left = []
+        with self._delayed_cond:
+            left.extend(payload for _, _, payload in self._delayed)
+            self._delayed.clear()
+        while True:
+            try:
+                payload, _ = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            left.append(payload)
+            self._queue.task_done()
+        for payload in left:
+            self._dead_letter(payload, "shutdown", 0)
+        print(f"⚠️ {len(left)} notification(s) not sent before shutdown, moved to dead letter")
+
+    def stats(self):
+        with self._lock:
+            sent = self.counters["sent"]
+            return {
+                **self.counters,
+                "depth": self._queue.qsize(),
+                "delayed": len(self._delayed),
+                "workers": len(self._threads),
+                "avg_send_ms": round(self.send_time * 1000 / sent, 2) if sent else 0.0
+            }
+
+
+class AdminDigest:
+    """
+    Coalesces admin events of one kind over `window` seconds.
+
+    The first event opens a window; every event until it closes is buffered
+    and then rendered into a single message by `render(events)`, so the
+    admin gets one WhatsApp per window instead of one per event.
+    """
+
+    def __init__(self, send, render, window=120.0):
+        self.send = send
+        self.render = render
+        self.window = window
+        self._lock = threading.Lock()
+        self._events = []
+        self._timer = None
+        self.events = 0
+        self.digests = 0
+
+    def add(self, event):
+        with self._lock:
+            self.events += 1
+            self._events.append(event)
+            if self.window <= 0:
+                events, self._events = self._events, []
+            elif self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+                return
+            else:
+                return
+        self._emit(events)
+
+    def flush(self):
+        with self._lock:
+            events, self._events = self._events, []
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer = None
+        if events:
+            self._emit(events)
+
+    def _emit(self, events):
+        with self._lock:
+            self.digests += 1
+        self.send(self.render(events))
+
+    def stats(self):
+        with self._lock:
+            return {"events": self.events, "digests": self.digests, "pending": len(self._events)}
+
+
+# Longest list rendered in one digest message
+DIGEST_MAX_LINES = 20
+
+
+def digest_lines(lines):
+    shown = lines[:DIGEST_MAX_LINES]
+    if len(lines) > DIGEST_MAX_LINES:
+        shown.append(f"... dan {len(lines) - DIGEST_MAX_LINES} lainnya")
+    return "\n".join(shown)
+
+
+def render_leave_requests(events):
+    if len(events) == 1:
+        e = events[0]
+        return f"📩 *Pengajuan Cuti Baru*\n\nNama: {e['name']}\nJenis: {e['type']}\nTanggal: {e['dates']}\n\nMohon review di dashboard."
+    lines = [f"- {e['name']} ({e['type']}, {e['dates']})" for e in events]
+    return f"📩 *{len(events)} Pengajuan Cuti Baru*\n\n{digest_lines(lines)}\n\nMohon review di dashboard."
+
+
+def render_late_checkins(events):
+    if len(events) == 1:
+        e = events[0]
+        return f"⚠️ *Terlambat Check-in*\n\nNama: {e['name']}\nTerlambat: {e['minutes']} Menit\n\nMohon diperhatikan."
+    lines = [f"- {e['name']}: {e['minutes']} Menit" for e in sorted(events, key=lambda e: -e['minutes'])]
+    return f"⚠️ *{len(events)} Terlambat Check-in*\n\n{digest_lines(lines)}\n\nMohon diperhatikan."
+
+
 class NotificationService:
     def __init__(self):
         # Gateway URL (Node.js service)
-        self.gateway_url = "http://localhost:3002/send"
+        self.gateway_url = os.getenv("WA_GATEWAY_URL", "http://localhost:3002/send")
+        self.dispatcher = NotificationDispatcher(
+            self.gateway_url,
+            workers=int(os.getenv("NOTIFY_WORKERS", 2)),
+            queue_size=int(os.getenv("NOTIFY_QUEUE_SIZE", 1000)),
+            max_retries=int(os.getenv("NOTIFY_MAX_RETRIES", 3)),
+            dead_letter_path=os.getenv(
+                "NOTIFY_DEAD_LETTER_PATH",
+                os.path.join(os.path.dirname(os.path.abspath(__file__)), "notifications_dead_letter.jsonl")
+            ),
+            rate_per_minute=float(os.getenv("NOTIFY_RATE_PER_MINUTE", 6)),
+            burst=int(os.getenv("NOTIFY_BURST", 3))
+        )
+        self.admin_number = os.getenv("ADMIN_WA_NUMBER", "628978643225") # Admin's Number
+        # Admin events are sent as one digest per window (0 = send each event)
+        window = float(os.getenv("ADMIN_DIGEST_WINDOW", 120))
+        send_admin = lambda msg: self._send_whatsapp(self.admin_number, msg)
+        self.leave_digest = AdminDigest(send_admin, render_leave_requests, window)
+        self.late_digest = AdminDigest(send_admin, render_late_checkins, window)
         print("✅ NotificationService ready (Targeting WhatsApp Gateway)")
 
     def _send_whatsapp(self, number, message):
-        try:
-            payload = {
-                "number": number,
-                "message": message
-            }
-            # Timeout increased to handle getNumberId latency
-            requests.post(self.gateway_url, json=payload, timeout=10)
-            print(f"✅ WA Sent to {number}")
-        except Exception as e:
-            print(f"⚠️ Failed to send WA (Gateway might be down): {e}")
+        # Queued, the caller never waits for the gateway
+        self.dispatcher.submit({
+            "number": number,
+            "message": message
+        })
+
+    def close(self, timeout=10.0):
+        # Pending digests first, so they go out with the rest of the queue
+        self.leave_digest.flush()
+        self.late_digest.flush()
+        self.dispatcher.close(timeout)
+
+    def stats(self):
+        return {
+            **self.dispatcher.stats(),
+            "leave_digest": self.leave_digest.stats(),
+            "late_digest": self.late_digest.stats()
+        }
 
     def notify_employee_checkin(self, employee_name, time_str, status, number):
         # Format: 628xxx (Indonesia)
@@ -32,16 +366,10 @@ class NotificationService:
         self._send_whatsapp(target_number, msg)
 
     def notify_admin_leave_request(self, employee_name, leave_type, dates):
-        target_number = "628978643225" # Admin's Number
-        
-        msg = f"📩 *Pengajuan Cuti Baru*\n\nNama: {employee_name}\nJenis: {leave_type}\nTanggal: {dates}\n\nMohon review di dashboard."
-        self._send_whatsapp(target_number, msg)
+        self.leave_digest.add({"name": employee_name, "type": leave_type, "dates": dates})
     
     def notify_admin_late_checkin(self, employee_name, minutes_late):
-        target_number = "628978643225" # Admin's Number
-        
-        msg = f"⚠️ *Terlambat Check-in*\n\nNama: {employee_name}\nTerlambat: {minutes_late} Menit\n\nMohon diperhatikan."
-        self._send_whatsapp(target_number, msg)
+        self.late_digest.add({"name": employee_name, "minutes": minutes_late})
 
     def notify_shift_change(self, employee_name, new_shift_name, start_time, end_time, number):
         if not number: return
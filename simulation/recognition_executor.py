@@ -0,0 +1,114 @@
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from recognition_worker import init_worker, analyze_session_frame, drop_session
+
+
+class RecognitionExecutor:
+    """
+    Runs the per-frame pipeline (decode, FaceMesh liveness, detection,
+    encoding) in worker processes, so concurrent kiosks are not serialised
+    on this process' GIL.
+
+    Each worker is a single-process pool. A socket session is pinned to one
+    worker on its first frame (least sessions wins) and stays there, because
+    the worker holds that session's ClientState (blink counter, last blink).
+    Each worker has a single FaceMesh (FaceMeshPool of size 1) shared by all
+    of its sessions, and processes one frame at a time. Frames of one
+    session are therefore processed in order, while different sessions
+    spread over all workers. Matching against the gallery stays in
+    the app process, where register/delete/sync keep it up to date.
+
+    If a worker process dies (OOM, a crash in dlib on a bad frame), its pool
+    is replaced by a fresh one in the same slot, so the sessions pinned
+    there keep their slot (their liveness state starts over) and the frame
+    is retried once.
+    """
+
+    def __init__(self, workers, detection_config, location_source="detector", decode_scale=1, liveness_required=True):
+        self._context = multiprocessing.get_context("spawn")
+        self._initargs = (detection_config, location_source, decode_scale, liveness_required)
+        self._pools = [self._new_pool() for _ in range(workers)]
+        self._restarts = [0] * workers
+        self._lock = threading.Lock()
+        self._assignment = {}               # sid -> worker index
+        self._load = [0] * workers          # sessions per worker
+        self._frames = [0] * workers
+        self._busy_time = [0.0] * workers
+
+    def _new_pool(self):
+        return ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=self._context,
+            initializer=init_worker,
+            initargs=self._initargs
+        )
+
+    def _replace(self, idx, broken):
+        with self._lock:
+            if self._pools[idx] is not broken:
+                return   # another session's thread already replaced it
+            self._pools[idx] = self._new_pool()
+            self._restarts[idx] += 1
+            sessions = self._load[idx]
+        broken.shutdown(wait=False, cancel_futures=True)
+        print(f"Recognition worker {idx} died, restarted it ({sessions} session(s) re-pinned)")
+
+    def _worker_for(self, sid):
+        with self._lock:
+            idx = self._assignment.get(sid)
+            if idx is None:
+                idx = min(range(len(self._pools)), key=lambda i: self._load[i])
+                self._assignment[sid] = idx
+                self._load[idx] += 1
+            return idx
+
+    def analyze(self, sid, data, track_box=None, track_iou=0.5):
+        """
+        Analyse one encoded frame of `sid` in its worker and wait for the
+        (encoding, failure, location) result. The calling thread only waits,
+        so other socket handlers keep running meanwhile.
+        """
+        idx = self._worker_for(sid)
+        start = time.perf_counter()
+        pool = self._pools[idx]
+        try:
+            result = pool.submit(analyze_session_frame, sid, data, track_box, track_iou).result()
+        except BrokenProcessPool:
+            self._replace(idx, pool)
+            result = self._pools[idx].submit(analyze_session_frame, sid, data, track_box, track_iou).result()
+        with self._lock:
+            self._frames[idx] += 1
+            self._busy_time[idx] += time.perf_counter() - start
+        return result
+
+    def drop_session(self, sid):
+        with self._lock:
+            idx = self._assignment.pop(sid, None)
+            if idx is None:
+                return
+            self._load[idx] -= 1
+        try:
+            self._pools[idx].submit(drop_session, sid)
+        except BrokenProcessPool:
+            pass   # state died with the worker; the next analyze() replaces it
+
+    def stats(self):
+        with self._lock:
+            return [
+                {
+                    "worker": i,
+                    "sessions": self._load[i],
+                    "frames": self._frames[i],
+                    "restarts": self._restarts[i],
+                    "avg_ms": round(self._busy_time[i] * 1000 / self._frames[i], 2) if self._frames[i] else 0.0
+                }
+                for i in range(len(self._pools))
+            ]
+
+    def shutdown(self):
+        for pool in self._pools:
+            pool.shutdown(wait=False, cancel_futures=True)
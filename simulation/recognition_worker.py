@@ -0,0 +1,287 @@
+"""
+Code that runs inside worker processes.
+
+Kept separate from app.py so worker processes only need this module's
+imports. Workers are spawned, and spawn re-imports the launching script in
+the child as __mp_main__. When app.py is run directly it is therefore
+imported again in every worker, and it skips its startup work (Supabase
+reads, gallery load, pools, background threads) there via IS_WORKER_PROCESS.
+"""
+import time
+import struct
+import numpy as np
+import cv2
+import face_recognition
+
+from face_detection import FaceDetector
+from frame_pipeline import ClientState, FaceMeshPool, analyze_frame
+
+# Per-process detector, created by init_worker
+_detector = None
+_location_source = "detector"
+_decode_scale = 1
+_liveness_required = True
+# Liveness state of the socket sessions pinned to this worker: { sid: ClientState }
+_sessions = {}
+# Frames are processed one at a time per worker, so one FaceMesh is enough
+_mesh_pool = FaceMeshPool(size=1, timeout=None)
+
+
+# Binary frame header (see decode_frame): magic, width, height, format, seq
+FRAME_MAGIC = b"AFR1"
+FRAME_HEADER = struct.Struct("<4sHHB3xI")
+FRAME_JPEG, FRAME_GRAY, FRAME_RGB = 0, 1, 2
+
+# Decode scale -> OpenCV reduced decode mode (JPEG DCT scaling)
+REDUCED_DECODE_FLAGS = {
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8
+}
+
+
+def init_worker(detection_config, location_source="detector", decode_scale=1, liveness_required=True):
+    global _detector, _location_source, _decode_scale, _liveness_required
+    _detector = FaceDetector(**detection_config)
+    _location_source = location_source
+    _decode_scale = decode_scale
+    _liveness_required = liveness_required
+
+
+def decode_image(data, flags=cv2.IMREAD_COLOR):
+    """
+    Encoded image bytes (JPEG/PNG/...) to an RGB array, or None.
+    """
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), flags)
+    if image is None:
+        return None
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+
+
+def frame_header(data):
+    """
+    Parsed (width, height, format, seq) header of a binary frame, or None
+    for plain encoded image bytes.
+    """
+    if len(data) < FRAME_HEADER.size or bytes(data[:4]) != FRAME_MAGIC:
+        return None
+    return FRAME_HEADER.unpack_from(data)[1:]
+
+
+def decode_frame(data):
+    """
+    One binary `process_frame` payload to an RGB array, or None.
+
+    The payload is either plain JPEG/PNG bytes, or a 16-byte header
+    (FRAME_HEADER) followed by JPEG bytes or a raw grayscale / RGB buffer of
+    width x height pixels. Raw buffers are viewed in place with
+    np.frombuffer (RGB frames are not copied at all).
+    """
+    header = frame_header(data)
+    if header is None:
+        return decode_image(data)
+    width, height, fmt, _ = header
+    offset = FRAME_HEADER.size
+    if fmt == FRAME_JPEG:
+        return decode_image(memoryview(data)[offset:])
+    if fmt == FRAME_GRAY:
+        pixels = width * height
+        if len(data) - offset < pixels:
+            return None
+        gray = np.frombuffer(data, np.uint8, count=pixels, offset=offset).reshape(height, width)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
+    if fmt == FRAME_RGB:
+        pixels = width * height * 3
+        if len(data) - offset < pixels:
+            return None
+        return np.frombuffer(data, np.uint8, count=pixels, offset=offset).reshape(height, width, 3)
+    return None
+
+
+def decode_frame_reduced(data, scale=1):
+    """
+    Decode policy for live frames. Returns (image, full_frame, scale).
+
+    With scale 2, 4 or 8, encoded frames are decoded at 1/scale resolution
+    (IMREAD_REDUCED_COLOR_*), which is enough for liveness and detection.
+    `full_frame` then decodes the full resolution on demand, only for frames
+    whose face actually needs encoding. Raw header frames and scale 1 are
+    decoded as usual (full_frame None, scale 1).
+    """
+    flags = REDUCED_DECODE_FLAGS.get(scale)
+    if flags is None:
+        return decode_frame(data), None, 1
+    header = frame_header(data)
+    if header is None:
+        encoded = data
+    elif header[2] == FRAME_JPEG:
+        encoded = memoryview(data)[FRAME_HEADER.size:]
+    else:
+        return decode_frame(data), None, 1
+    image = decode_image(encoded, flags)
+    if image is None:
+        return None, None, 1
+    return image, lambda: decode_image(encoded), scale
+
+
+def encode_image(data):
+    """
+    Decode one image and compute the encoding of its first face.
+
+    Returns {"encoding": [...] or None, "error": str or None, "timing_ms": {...}}.
+    """
+    timing = {}
+    start = time.perf_counter()
+    image = decode_image(data)
+    timing["decode"] = round((time.perf_counter() - start) * 1000, 2)
+    if image is None:
+        return {"encoding": None, "error": "Invalid image", "timing_ms": timing}
+
+    start = time.perf_counter()
+    locations = _detector.detect(image) if _detector else face_recognition.face_locations(image)
+    timing["detect"] = round((time.perf_counter() - start) * 1000, 2)
+    if not locations:
+        return {"encoding": None, "error": "No face detected", "timing_ms": timing}
+
+    start = time.perf_counter()
+    encodings = face_recognition.face_encodings(image, locations[:1])
+    timing["encode"] = round((time.perf_counter() - start) * 1000, 2)
+    if not encodings:
+        return {"encoding": None, "error": "No face detected", "timing_ms": timing}
+    return {"encoding": encodings[0], "error": None, "timing_ms": timing}
+
+
+# Enrollment photo quality limits (see enroll_image)
+DEFAULT_ENROLL_LIMITS = {
+    "min_face_px": 80,       # shorter side of the face box, full resolution
+    "min_sharpness": 60.0,   # variance of the Laplacian of the face crop
+    "max_yaw": 0.35,         # nose offset from the eye midpoint / eye distance
+    "max_roll": 20.0         # eye line tilt, degrees
+}
+# Face crops are resized to this before measuring sharpness, so the value
+# does not depend on photo resolution
+SHARPNESS_CROP_PX = 160
+
+
+def face_quality(image, location, limits):
+    """
+    Size, sharpness and pose of one face. Returns the measurements, a score
+    in [0, 1] (mean of the three parts, each 1.0 at twice the limit) and
+    whether every limit is met.
+    """
+    top, right, bottom, left = location
+    size = min(bottom - top, right - left)
+
+    crop = image[max(0, top):bottom, max(0, left):right]
+    gray = cv2.cvtColor(crop, cv2.COLOR_RGB2GRAY)
+    gray = cv2.resize(gray, (SHARPNESS_CROP_PX, SHARPNESS_CROP_PX), interpolation=cv2.INTER_AREA)
+    sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+    # 5-point landmarks: two corners per eye and the nose tip
+    yaw = roll = None
+    landmarks = face_recognition.face_landmarks(image, [location], model="small")
+    if landmarks:
+        points = landmarks[0]
+        left_eye = np.mean(points["left_eye"], axis=0)
+        right_eye = np.mean(points["right_eye"], axis=0)
+        nose = np.asarray(points["nose_tip"][0], dtype=np.float64)
+        eye_vector = right_eye - left_eye
+        eye_distance = float(np.hypot(*eye_vector)) or 1.0
+        yaw = float((nose[0] - (left_eye[0] + right_eye[0]) / 2) / eye_distance)
+        roll = float(np.degrees(np.arctan2(eye_vector[1], eye_vector[0])))
+        # Eye order depends on the image side, keep the tilt within +-90
+        if roll > 90:
+            roll -= 180
+        elif roll < -90:
+            roll += 180
+
+    size_score = min(1.0, size / (2 * limits["min_face_px"]))
+    sharp_score = min(1.0, sharpness / (2 * limits["min_sharpness"]))
+    if yaw is None:
+        pose_score = 0.0
+    else:
+        pose_score = max(0.0, 1 - max(abs(yaw) / limits["max_yaw"], abs(roll) / limits["max_roll"]) / 2)
+
+    problems = []
+    if size < limits["min_face_px"]:
+        problems.append("face too small")
+    if sharpness < limits["min_sharpness"]:
+        problems.append("blurry")
+    if yaw is None or abs(yaw) > limits["max_yaw"] or abs(roll) > limits["max_roll"]:
+        problems.append("face not frontal")
+
+    return {
+        "face_px": int(size),
+        "sharpness": round(sharpness, 1),
+        "yaw": None if yaw is None else round(yaw, 3),
+        "roll": None if roll is None else round(roll, 1),
+        "score": round((size_score + sharp_score + pose_score) / 3, 3),
+        "problems": problems,
+        "accepted": not problems
+    }
+
+
+def enroll_image(data, limits=None):
+    """
+    Enrollment step for one photo: decode, locate the largest face, score
+    its quality and encode it.
+
+    Returns {"encoding": [...] or None, "error": str or None,
+             "quality": {...} or None, "faces": int, "timing_ms": {...}}.
+    """
+    limits = {**DEFAULT_ENROLL_LIMITS, **(limits or {})}
+    timing = {}
+    result = {"encoding": None, "error": None, "quality": None, "faces": 0, "timing_ms": timing}
+
+    start = time.perf_counter()
+    image = decode_image(data)
+    timing["decode"] = round((time.perf_counter() - start) * 1000, 2)
+    if image is None:
+        result["error"] = "Invalid image"
+        return result
+
+    # Full-resolution HOG, as registration always used
+    start = time.perf_counter()
+    locations = face_recognition.face_locations(image)
+    timing["detect"] = round((time.perf_counter() - start) * 1000, 2)
+    result["faces"] = len(locations)
+    if not locations:
+        result["error"] = "No face detected"
+        return result
+    location = max(locations, key=lambda l: (l[2] - l[0]) * (l[1] - l[3]))
+
+    start = time.perf_counter()
+    result["quality"] = face_quality(image, location, limits)
+    timing["quality"] = round((time.perf_counter() - start) * 1000, 2)
+
+    start = time.perf_counter()
+    encodings = face_recognition.face_encodings(image, [location])
+    timing["encode"] = round((time.perf_counter() - start) * 1000, 2)
+    if not encodings:
+        result["error"] = "No face detected"
+        return result
+    result["encoding"] = encodings[0]
+    return result
+
+
+def analyze_session_frame(sid, data, track_box=None, track_iou=0.5):
+    """
+    frame_pipeline.analyze_frame for one binary frame (see decode_frame) of
+    session `sid`. Returns (encoding, failure, location) like analyze_frame.
+    """
+    image, full_frame, scale = decode_frame_reduced(data, _decode_scale)
+    if image is None:
+        return None, {"success": False, "error": "Processing error"}, None
+    state = _sessions.get(sid)
+    if state is None:
+        state = _sessions[sid] = ClientState()
+    return analyze_frame(
+        image, state, _detector, _location_source, track_box, track_iou,
+        full_frame=full_frame, scale=scale, mesh_pool=_mesh_pool,
+        liveness_required=_liveness_required
+    )
+
+
+def drop_session(sid):
+    _sessions.pop(sid, None)
+    return len(_sessions)
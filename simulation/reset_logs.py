@@ -1,9 +1,10 @@
-from supabase import create_client
 from datetime import date
+from dotenv import load_dotenv
 
-SUPABASE_URL = "https://nmiwdhrivuolmnddwcge.supabase.co"
-SUPABASE_KEY = "sb_publishable_9536nM2zv2xK01gLQ0Dtlw_3CZ7PqD4"
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+from data_store import open_data_store
+
+load_dotenv()
+supabase = open_data_store()
 
 today = date.today().isoformat()
 print(f"Clearing logs for {today}...")
@@ -0,0 +1,132 @@
+import time
+import threading
+from collections import OrderedDict
+
+
+class TTLStore:
+    """
+    Thread-safe dict with time-to-live expiry and an LRU size cap.
+
+    Writing a key refreshes its age and makes it most recently used; reads do
+    not, so an entry expires `ttl` seconds after it was last written. When
+    more than `max_size` keys are stored the least recently written ones are
+    evicted. Expired entries are removed by sweep() (see start_sweeper) and
+    are never returned by reads in between.
+
+    `on_evict(key, value)` is called, outside the lock, for every entry
+    removed by expiry or the size cap, but not for pop()/del.
+    """
+
+    def __init__(self, ttl, max_size=None, on_evict=None, name=None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.on_evict = on_evict
+        self.name = name
+        self._lock = threading.Lock()
+        self._data = OrderedDict()   # key -> (written_at, value), oldest first
+        self.expired = 0
+        self.evicted = 0
+
+    def _alive(self, item, now):
+        return self.ttl is None or now - item[0] < self.ttl
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or not self._alive(item, time.monotonic()):
+                return default
+            return item[1]
+
+    def __getitem__(self, key):
+        value = self.get(key, _MISSING)
+        if value is _MISSING:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __setitem__(self, key, value):
+        evicted = []
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            if self.max_size is not None:
+                while len(self._data) > self.max_size:
+                    old_key, (_, old_value) = self._data.popitem(last=False)
+                    self.evicted += 1
+                    evicted.append((old_key, old_value))
+        self._notify(evicted)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+        return default if item is None else item[1]
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+    def sweep(self):
+        """
+        Remove expired entries. Returns how many were removed.
+        """
+        if self.ttl is None:
+            return 0
+        expired = []
+        now = time.monotonic()
+        with self._lock:
+            # Oldest writes first, so stop at the first live entry
+            while self._data:
+                key, item = next(iter(self._data.items()))
+                if self._alive(item, now):
+                    break
+                del self._data[key]
+                expired.append((key, item[1]))
+            self.expired += len(expired)
+        self._notify(expired)
+        return len(expired)
+
+    def _notify(self, entries):
+        if not self.on_evict:
+            return
+        for key, value in entries:
+            try:
+                self.on_evict(key, value)
+            except Exception as e:
+                print(f"TTLStore {self.name or ''} eviction callback error: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._data),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "expired": self.expired,
+                "evicted": self.evicted
+            }
+
+
+_MISSING = object()
+
+
+def start_sweeper(stores, interval=30.0):
+    """
+    Daemon thread calling sweep() on every store each `interval` seconds.
+    """
+    def loop():
+        while True:
+            time.sleep(interval)
+            for store in stores:
+                try:
+                    store.sweep()
+                except Exception as e:
+                    print(f"TTLStore sweep error ({store.name}): {e}")
+
+    thread = threading.Thread(target=loop, daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,116 @@
+"""
+Check that the compact gallery storage modes (float32 / int8) make the same
+match decisions as float64 at the production tolerance.
+
+Labelled test set, one of:
+  --images DIR   DIR/<employee_id>/*.jpg, a folder named "unknown" holds
+                 impostors that must not match anyone
+  --holdout      no images needed: the first encoding of every employee with
+                 2+ encodings is the probe, the remaining ones form the gallery
+
+Usage:
+  python verify_gallery_precision.py --holdout
+  python verify_gallery_precision.py --images ./labelled_faces
+
+Exits with status 1 if any mode disagrees with float64 on any probe.
+"""
+import os
+import sys
+import argparse
+import numpy as np
+from dotenv import load_dotenv
+
+from data_store import open_data_store
+from face_gallery import FaceGallery, STORAGE_DTYPES
+
+TOLERANCE = 0.5
+
+
+def fetch_employees():
+    load_dotenv()
+    supabase = open_data_store()
+    res = supabase.table('employees').select("id, face_encoding").execute()
+    return {e['id']: e['face_encoding'] for e in res.data if e.get('face_encoding')}
+
+
+def holdout_set(employees):
+    gallery, probes, labels = {}, [], []
+    for emp_id, encodings in employees.items():
+        if len(encodings) >= 2:
+            probes.append(encodings[0])
+            labels.append(emp_id)
+            gallery[emp_id] = encodings[1:]
+        else:
+            gallery[emp_id] = encodings
+    return gallery, np.array(probes), labels
+
+
+def image_set(directory):
+    import face_recognition
+
+    probes, labels = [], []
+    for label in sorted(os.listdir(directory)):
+        folder = os.path.join(directory, label)
+        if not os.path.isdir(folder):
+            continue
+        for name in sorted(os.listdir(folder)):
+            image = face_recognition.load_image_file(os.path.join(folder, name))
+            encodings = face_recognition.face_encodings(image)
+            if not encodings:
+                print(f"  skipped {label}/{name}: no face")
+                continue
+            probes.append(encodings[0])
+            labels.append(None if label == "unknown" else label)
+    return np.array(probes), labels
+
+
+def build(dtype, gallery):
+    g = FaceGallery(dtype=dtype)
+    g.calibrate([e for encodings in gallery.values() for e in encodings])
+    for emp_id, encodings in gallery.items():
+        g.add(emp_id, encodings)
+    return g
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--images", help="folder of labelled face images")
+    parser.add_argument("--holdout", action="store_true", help="hold out one stored encoding per employee")
+    args = parser.parse_args()
+    if not args.images and not args.holdout:
+        parser.error("use --images DIR or --holdout")
+
+    employees = fetch_employees()
+    if args.holdout:
+        gallery, probes, labels = holdout_set(employees)
+    else:
+        gallery = employees
+        probes, labels = image_set(args.images)
+    print(f"Gallery: {len(gallery)} employees, probes: {len(probes)}")
+    if len(probes) == 0:
+        print("Nothing to verify.")
+        return 0
+
+    reference = None
+    failed = False
+    for dtype in STORAGE_DTYPES:
+        g = build(dtype, gallery)
+        decisions = [uid for uid, _ in g.match_many(probes, TOLERANCE)]
+        correct = sum(1 for d, label in zip(decisions, labels) if d == label)
+
+        line = f"{dtype:>8}: {g.memory_bytes() / 1024:.0f} KiB, accuracy {correct}/{len(labels)}"
+        if reference is None:
+            reference = decisions
+        else:
+            diffs = [i for i, (a, b) in enumerate(zip(reference, decisions)) if a != b]
+            line += f", decisions changed vs float64: {len(diffs)}"
+            for i in diffs[:10]:
+                line += f"\n          probe {i} ({labels[i]}): float64={reference[i]} {dtype}={decisions[i]}"
+            failed = failed or bool(diffs)
+        print(line)
+
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())